@@ -0,0 +1,154 @@
+from __future__ import annotations
+import csv, io, json, tempfile
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from openpyxl.styles import NamedStyle
+
+try:
+    import orjson
+except ImportError:  # opzionale: senza orjson si usa json della stdlib
+    orjson = None
+
+# Export streaming: nessun DataFrame, una sola passata sui dati, scrittura
+# xlsx in modalità write-only e chunk inviati al client man mano.
+
+CHUNK_SIZE = 64 * 1024
+WRAP_COLS = {"Telefono/i", "Email", "Indirizzo", "Sito web"}
+
+def _join_list(v: Any) -> str:
+    return "\n".join(v) if isinstance(v, list) else (v or "")
+
+COLUMNS: List[Tuple[str, Callable[[dict, str], Any]]] = [
+    ("Nome", lambda it, u: it.get("name") or ""),
+    ("Tipo", lambda it, u: it.get("entity_type") or ""),
+    ("Telefono/i", lambda it, u: _join_list(it.get("phones"))),
+    ("Email", lambda it, u: _join_list(it.get("emails"))),
+    ("Sito web", lambda it, u: it.get("website") or ""),
+    ("Indirizzo", lambda it, u: it.get("address") or ""),
+    ("Località", lambda it, u: it.get("locality") or ""),
+    ("Regione", lambda it, u: it.get("region") or ""),
+    ("CAP", lambda it, u: it.get("postal_code") or ""),
+    ("Paese", lambda it, u: it.get("country") or ""),
+    ("Rating", lambda it, u: it.get("rating") if it.get("rating") is not None else ""),
+    ("URL sorgente", lambda it, u: it.get("source_url") or u),
+]
+HEADERS = [c[0] for c in COLUMNS]
+
+def iter_rows(items: Iterable[dict], url: str) -> Iterator[list]:
+    getters = [c[1] for c in COLUMNS]
+    for it in items:
+        yield [g(it, url) for g in getters]
+
+
+def _styles() -> Tuple[NamedStyle, NamedStyle, NamedStyle]:
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+    thin = Side(border_style="thin", color="FFDDDDDD")
+    header = NamedStyle(name="intestazione",
+                        font=Font(bold=True),
+                        fill=PatternFill(start_color="FFEFEFEF", end_color="FFEFEFEF", fill_type="solid"),
+                        border=Border(top=thin, left=thin, right=thin, bottom=thin))
+    cell = NamedStyle(name="dato", alignment=Alignment(vertical="top"))
+    wrap = NamedStyle(name="dato_a_capo", alignment=Alignment(wrap_text=True, vertical="top"))
+    return header, cell, wrap
+
+def write_xlsx(items: Iterable[dict], url: str, fileobj) -> None:
+    # blocking: chiamare fuori dall'event loop
+    # openpyxl caricato solo al primo export xlsx
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+    # una passata: righe + larghezze colonne (in write-only vanno impostate prima delle righe)
+    rows: List[list] = []
+    widths = [len(h) for h in HEADERS]
+    for row in iter_rows(items, url):
+        for i, v in enumerate(row):
+            n = len(str(v))
+            if n > widths[i]:
+                widths[i] = n
+        rows.append(row)
+
+    wb = Workbook(write_only=True)
+    header_style, cell_style, wrap_style = _styles()
+    for st in (header_style, cell_style, wrap_style):
+        wb.add_named_style(st)
+    ws = wb.create_sheet("Contatti")
+    for i, w in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = max(12, min(w, 80) + 2)
+    ws.freeze_panes = "A2"
+    ws.auto_filter.ref = f"A1:{get_column_letter(len(HEADERS))}{len(rows) + 1}"
+    col_styles = [wrap_style.name if h in WRAP_COLS else cell_style.name for h in HEADERS]
+
+    def styled(value, style):
+        c = WriteOnlyCell(ws, value=value)
+        c.style = style
+        return c
+
+    ws.append([styled(h, header_style.name) for h in HEADERS])
+    for row in rows:
+        ws.append([styled(v, s) for v, s in zip(row, col_styles)])
+    wb.save(fileobj)
+
+def xlsx_spooled(items: Iterable[dict], url: str, max_memory: int = 8 * 1024 * 1024):
+    # file temporaneo in RAM fino a max_memory, poi su disco
+    f = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    try:
+        write_xlsx(items, url, f)
+        f.seek(0)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+def iter_file(f, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def iter_csv(items: Iterable[dict], url: str, rows_per_chunk: int = 500) -> Iterator[bytes]:
+    # BOM: Excel riconosce così l'UTF-8
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    buf.write("\ufeff")
+    w.writerow(HEADERS)
+    for n, row in enumerate(iter_rows(items, url), start=1):
+        w.writerow(row)
+        if n % rows_per_chunk == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    # JSON UTF-8 direttamente in bytes
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def iter_ndjson(items: Iterable[dict]) -> Iterator[bytes]:
+    for it in items:
+        yield dumps(it) + b"\n"
+
+def iter_json(head: dict, key: str, items: Iterable[Any], tail: dict, items_per_chunk: int = 256) -> Iterator[bytes]:
+    # {**head, key: [items...], **tail} a chunk: la lista non viene mai serializzata tutta insieme
+    yield dumps(head)[:-1] + (b"," if head else b"") + dumps(key) + b":["
+    buf: List[bytes] = []
+    sep = b""
+    for it in items:
+        buf.append(dumps(it))
+        if len(buf) >= items_per_chunk:
+            yield sep + b",".join(buf)
+            sep, buf = b",", []
+    if buf:
+        yield sep + b",".join(buf)
+    yield b"]" + (b"," + dumps(tail)[1:] if tail else b"}")
@@ -1,19 +1,101 @@
-from fastapi import FastAPI, Request, Form
+import asyncio, os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Form, HTTPException
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import json
-from models import Entity
-from scraping.runner import scrape_url
+from typing import Optional
+from models import BatchScrapeRequest, entity_json
+from scraping.runner import scrape_url, scrape_urls
+from scraping.http_client import start_client, close_client, get_client
+from scraping.robots import get_robots_cache
+from scraping.browser_pool import get_browser_pool, close_browser_pool
+from scraping.result_cache import get_result_cache
+from scraping.parse_executor import shutdown_parse_executor
+from scraping.store import get_entity_store, close_entity_store
+from scraping.http_cache import get_http_cache, close_http_cache
+from scraping.strategy import get_strategy_tracker, close_strategy_tracker
+from scraping.jobs import Job, JobQueueFull, get_job_manager, stop_job_manager
+from scraping.utils import env_int
+from scraping.metrics import REGISTRY, stage, start_request_timings, server_timing_header
 from fastapi.responses import Response, JSONResponse
-from io import BytesIO
-import pandas as pd
+from app.exporters import xlsx_spooled, iter_file, iter_csv, iter_ndjson, iter_json, dumps
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_client()
+    get_job_manager().start()
+    warm = env_int("BROWSER_POOL_WARM", 0)
+    if warm > 0 and not os.getenv("DISABLE_BROWSER"):
+        # pre-launch Chrome in background, startup must not wait for it
+        asyncio.get_running_loop().run_in_executor(None, get_browser_pool().warm, warm)
+    try:
+        yield
+    finally:
+        await stop_job_manager()
+        await close_client()
+        close_browser_pool()
+        shutdown_parse_executor()
+        close_entity_store()
+        close_http_cache()
+        close_strategy_tracker()
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    timings = start_request_timings()
+    response = await call_next(request)
+    # per le risposte in streaming contano solo le fasi concluse prima degli header
+    if timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+# oltre questa soglia la risposta JSON parte a chunk invece di essere costruita tutta in memoria
+JSON_STREAM_MIN_ITEMS = env_int("JSON_STREAM_MIN_ITEMS", 256)
+
+def _items_json(items, url_str: Optional[str] = None):
+    with stage("serialize"):
+        return [entity_json(i, url_str) for i in items]
+
+def _json_items_response(head: dict, items: list, tail: dict, convert=entity_json, key: str = "items",
+                         headers: Optional[dict] = None) -> Response:
+    rows = (convert(i) for i in items)
+    if len(items) <= JSON_STREAM_MIN_ITEMS:
+        with stage("serialize"):
+            body = b"".join(iter_json(head, key, rows, tail))
+        return Response(body, media_type="application/json", headers=headers)
+    return StreamingResponse(iter_json(head, key, rows, tail), media_type="application/json", headers=headers)
+
+def _collect_caches():
+    # contatori già tenuti dalle cache, letti solo quando /metrics viene interrogato
+    hits = []
+    caches = [("robots", get_robots_cache().stats()), ("http", (c := get_http_cache()) and c.stats()),
+              ("result", (c := get_result_cache()) and c.stats())]
+    for name, st in caches:
+        if not st:
+            continue
+        for kind in ("hits", "misses", "revalidated", "coalesced"):
+            if kind in st:
+                hits.append(({"cache": name, "result": kind}, st[kind]))
+    yield ("scrape_cache_lookups_total", "counter", "Cache lookups by cache and outcome", hits)
+    states = get_strategy_tracker().stats()["states"]
+    yield ("scrape_strategy_domains", "gauge", "Known domains by HTTP circuit state (open = browser first)",
+           [({"state": k}, v) for k, v in states.items()])
+    pool = get_client().stats()
+    yield ("scrape_http_pool_connections", "gauge", "Open connections in the shared HTTP pool",
+           [({}, pool.get("open_connections", 0))])
+
+REGISTRY.register_collector(_collect_caches)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 
 @app.get("/.well-known/appspecific/com.chrome.devtools.json", include_in_schema=False)
 def _devtools_probe():
@@ -23,6 +105,19 @@ def _devtools_probe():
 def _favicon():
     return Response(status_code=204)
 
+@app.get("/api/stats")
+async def api_stats():
+    return JSONResponse({
+        "http_pool": get_client().stats(),
+        "robots_cache": get_robots_cache().stats(),
+        "browser_pool": get_browser_pool().stats(),
+        "result_cache": cache.stats() if (cache := get_result_cache()) else None,
+        "entity_store": store.stats() if (store := get_entity_store()) else None,
+        "http_cache": http_cache.stats() if (http_cache := get_http_cache()) else None,
+        "jobs": get_job_manager().stats(),
+        "strategy": get_strategy_tracker().stats(),
+    })
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "result_json": None})
@@ -32,17 +127,18 @@ async def do_scrape(request: Request,
                     url: str = Form(...),
                     use_browser: bool = Form(False),
                     max_wait_ms: int = Form(2000),
-                    respect_robots: bool = Form(True)):
+                    respect_robots: bool = Form(True),
+                    crawl: bool = Form(False)):
     url_str = str(url)
-    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots)
-    items_json = [Entity(**{**i, "source_url": url_str}).model_dump(mode="json") for i in items]
+    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots, crawl)
+    items_json = _items_json(items, url_str)
     payload = {
         "ok": len(items_json) > 0,
         "url": url_str,
         "items": items_json,
         "errors": errors,
     }
-    result_json = json.dumps(payload, ensure_ascii=False, indent=2)
+    result_json = dumps(payload, indent=True).decode("utf-8")
 
     return templates.TemplateResponse("index.html", {
         "request": request,
@@ -51,80 +147,194 @@ async def do_scrape(request: Request,
         "form_use_browser": "true" if use_browser else "false",
         "form_respect_robots": "true" if respect_robots else "false",
         "form_max_wait_ms": max_wait_ms,
+        "form_crawl": "true" if crawl else "false",
     })
 
 
 @app.get("/api/scrape")
-async def api_scrape(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True):
+async def api_scrape(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                     crawl: bool = False, max_pages: Optional[int] = None):
     url_str = str(url)
-    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots)
-    items_json = [Entity(**{**i, "source_url": url_str}).model_dump(mode="json") for i in items]
-    payload = {
-        "ok": len(items_json) > 0,
-        "url": url_str,
-        "items": items_json,
-        "errors": errors,
-    }
-    return JSONResponse(payload)
+    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots, crawl, max_pages)
+    return _json_items_response({"ok": len(items) > 0, "url": url_str}, items, {"errors": errors},
+                                lambda i: entity_json(i, url_str))
+
+
+@app.post("/api/scrape/batch")
+async def api_scrape_batch(req: BatchScrapeRequest):
+    max_urls = env_int("BATCH_MAX_URLS", 1000)
+    if len(req.urls) > max_urls:
+        raise HTTPException(status_code=413, detail=f"Too many URLs (max {max_urls})")
+
+    async def lines():
+        # NDJSON: una riga per URL, nell'ordine in cui finiscono
+        async for url_str, items, errors in scrape_urls(req.urls, req.use_browser, req.max_wait_ms, req.respect_robots,
+                                                           crawl=req.crawl, max_pages=req.max_pages):
+            payload = {
+                "ok": len(items) > 0,
+                "url": url_str,
+                "items": _items_json(items, url_str),
+                "errors": errors,
+            }
+            yield dumps(payload) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.get("/download.json")
-async def download_json(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True):
+async def download_json(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                        crawl: bool = False, max_pages: Optional[int] = None):
     url_str = str(url)
-    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots)
-    items_json = [Entity(**{**i, "source_url": url_str}).model_dump(mode="json") for i in items]
-    payload = {
-        "ok": len(items_json) > 0,
-        "url": url_str,
-        "items": items_json,
-        "errors": errors,
-    }
-    data = json.dumps(payload, ensure_ascii=False, indent=2)
-    return StreamingResponse(iter([data]), media_type="application/json",
-                             headers={"Content-Disposition": "attachment; filename=contacts.json"})
+    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots, crawl, max_pages)
+    return _json_items_response({"ok": len(items) > 0, "url": url_str}, items, {"errors": errors},
+                                lambda i: entity_json(i, url_str),
+                                headers={"Content-Disposition": "attachment; filename=contacts.json"})
 
 @app.get("/download.xlsx")
-async def download_xlsx(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True):
+async def download_xlsx(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                        crawl: bool = False, max_pages: Optional[int] = None):
     url_str = str(url)
-    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots)
-
-    def join_list(v): return "\n".join(v) if isinstance(v, list) else (v or "")
-    rows = [{
-        "Nome": it.get("name") or "",
-        "Tipo": it.get("entity_type") or "",
-        "Telefono/i": join_list(it.get("phones")),
-        "Email": join_list(it.get("emails")),
-        "Sito web": it.get("website") or "",
-        "Indirizzo": it.get("address") or "",
-        "Località": it.get("locality") or "",
-        "Regione": it.get("region") or "",
-        "CAP": it.get("postal_code") or "",
-        "Paese": it.get("country") or "",
-        "Rating": it.get("rating") if it.get("rating") is not None else "",
-        "URL sorgente": it.get("source_url") or url_str,
-    } for it in items]
-
-    df = pd.DataFrame(rows or [{}])
-    bio = BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Contatti")
-        ws = writer.sheets["Contatti"]
-        from openpyxl.styles import Alignment, Font, PatternFill, Side, Border
-        thin = Side(border_style="thin", color="FFDDDDDD")
-        border = Border(top=thin, left=thin, right=thin, bottom=thin)
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color="FFEFEFEF", end_color="FFEFEFEF", fill_type="solid")
-            cell.border = border
-        ws.freeze_panes = "A2"
-        ws.auto_filter.ref = ws.dimensions
-        wrap_cols = ["Telefono/i", "Email", "Indirizzo", "Sito web"]
-        for col_idx, col in enumerate(df.columns, start=1):
-            max_len = max([len(str(v)) if v is not None else 0 for v in df[col]] + [len(col)])
-            max_len = min(max_len, 80)
-            ws.column_dimensions[ws.cell(row=1, column=col_idx).column_letter].width = max(12, max_len + 2)
-            for row in range(2, ws.max_row + 1):
-                ws.cell(row=row, column=col_idx).alignment = Alignment(wrap_text=(col in wrap_cols), vertical="top")
-    bio.seek(0)
-    return StreamingResponse(bio, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots, crawl, max_pages)
+    # scrittura write-only in un thread, poi invio a chunk dal file temporaneo
+    with stage("export"):
+        f = await asyncio.to_thread(xlsx_spooled, items, url_str)
+    return StreamingResponse(iter_file(f), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                              headers={"Content-Disposition": "attachment; filename=contacts.xlsx"})
+
+@app.get("/download.csv")
+async def download_csv(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                       crawl: bool = False, max_pages: Optional[int] = None):
+    url_str = str(url)
+    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots, crawl, max_pages)
+    return StreamingResponse(iter_csv(items, url_str), media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": "attachment; filename=contacts.csv"})
+
+@app.get("/download.ndjson")
+async def download_ndjson(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                          crawl: bool = False, max_pages: Optional[int] = None):
+    url_str = str(url)
+    items, errors = await scrape_url(url_str, use_browser, max_wait_ms, respect_robots, crawl, max_pages)
+    items_json = (entity_json(i, url_str) for i in items)
+    return StreamingResponse(iter_ndjson(items_json), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": "attachment; filename=contacts.ndjson"})
+
+
+def _store_or_404():
+    store = get_entity_store()
+    if store is None:
+        raise HTTPException(status_code=404, detail="Entity store disabled (set ENTITY_STORE_PATH)")
+    return store
+
+@app.get("/api/entities")
+async def api_entities(locality: Optional[str] = None, region: Optional[str] = None,
+                       min_rating: Optional[float] = None, max_rating: Optional[float] = None,
+                       limit: int = 100, offset: int = 0):
+    store = _store_or_404()
+    items = await asyncio.to_thread(store.query, locality, region, min_rating, max_rating, limit, offset)
+    return _json_items_response({}, items, {"count": len(items)})
+
+@app.get("/store/download.{fmt}")
+async def download_from_store(fmt: str, locality: Optional[str] = None, region: Optional[str] = None,
+                              min_rating: Optional[float] = None, max_rating: Optional[float] = None,
+                              limit: Optional[int] = None):
+    # export dallo store, senza ri-scrapare
+    store = _store_or_404()
+    items = await asyncio.to_thread(store.query, locality, region, min_rating, max_rating, limit)
+    if fmt == "xlsx":
+        with stage("export"):
+            f = await asyncio.to_thread(xlsx_spooled, items, "")
+        return StreamingResponse(iter_file(f), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                 headers={"Content-Disposition": "attachment; filename=contacts.xlsx"})
+    if fmt == "csv":
+        return StreamingResponse(iter_csv(items, ""), media_type="text/csv; charset=utf-8",
+                                 headers={"Content-Disposition": "attachment; filename=contacts.csv"})
+    if fmt == "ndjson":
+        items_json = (entity_json(i) for i in items)
+        return StreamingResponse(iter_ndjson(items_json), media_type="application/x-ndjson",
+                                 headers={"Content-Disposition": "attachment; filename=contacts.ndjson"})
+    raise HTTPException(status_code=404, detail=f"Unknown export format: {fmt}")
+
+
+# --------------------- Job in background ---------------------
+
+def _job_or_404(job_id: str) -> Job:
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/jobs", status_code=202)
+async def api_job_submit(req: BatchScrapeRequest):
+    max_urls = env_int("BATCH_MAX_URLS", 1000)
+    if len(req.urls) > max_urls:
+        raise HTTPException(status_code=413, detail=f"Too many URLs (max {max_urls})")
+    job = Job(req.urls, req.use_browser, req.max_wait_ms, req.respect_robots, req.crawl, req.max_pages)
+    try:
+        get_job_manager().submit(job)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return {**job.summary(), "status_url": f"/api/jobs/{job.id}", "events_url": f"/api/jobs/{job.id}/events"}
+
+@app.get("/api/jobs/{job_id}")
+async def api_job_status(job_id: str):
+    return _job_or_404(job_id).summary()
+
+@app.delete("/api/jobs/{job_id}")
+async def api_job_cancel(job_id: str):
+    _job_or_404(job_id)
+    return get_job_manager().cancel(job_id).summary()
+
+@app.get("/api/jobs/{job_id}/results")
+async def api_job_results(job_id: str):
+    job = _job_or_404(job_id)
+    def result(u: str) -> dict:
+        r = job.results[u]
+        return {"url": u, "ok": len(r["items"]) > 0, "items": [entity_json(i) for i in r["items"]], "errors": r["errors"]}
+
+    return _json_items_response(job.summary(), [u for u in job.urls if u in job.results], {}, result, key="results")
+
+@app.get("/api/jobs/{job_id}/events")
+async def api_job_events(job_id: str, request: Request):
+    job = _job_or_404(job_id)
+
+    async def events():
+        # SSE: un evento "progress" a ogni URL completato, "end" alla fine.
+        # Si confronta la versione del job: un cambiamento arrivato mentre si
+        # inviava il keep-alive non va perso
+        seen = -1
+        while True:
+            if job.version != seen or job.finished:
+                seen = job.version
+                summary = json.dumps(job.summary())
+                yield f"event: progress\ndata: {summary}\n\n"
+                if job.finished:
+                    yield f"event: end\ndata: {summary}\n\n"
+                    return
+            elif await request.is_disconnected():
+                return
+            else:
+                yield ": keep-alive\n\n"
+            await job.wait_changed(seen, 15)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/jobs/{job_id}/download.{fmt}")
+async def api_job_download(job_id: str, fmt: str):
+    job = _job_or_404(job_id)
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    items = job.items()
+    if fmt == "xlsx":
+        with stage("export"):
+            f = await asyncio.to_thread(xlsx_spooled, items, "")
+        return StreamingResponse(iter_file(f), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                 headers={"Content-Disposition": f"attachment; filename=job-{job.id}.xlsx"})
+    if fmt == "csv":
+        return StreamingResponse(iter_csv(items, ""), media_type="text/csv; charset=utf-8",
+                                 headers={"Content-Disposition": f"attachment; filename=job-{job.id}.csv"})
+    if fmt == "ndjson":
+        items_json = (entity_json(i) for i in items)
+        return StreamingResponse(iter_ndjson(items_json), media_type="application/x-ndjson",
+                                 headers={"Content-Disposition": f"attachment; filename=job-{job.id}.ndjson"})
+    raise HTTPException(status_code=404, detail=f"Unknown export format: {fmt}")
+
@@ -0,0 +1,291 @@
+from __future__ import annotations
+import argparse, asyncio, io, json, os, platform, resource, subprocess, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Offline benchmarks: parser, fallback regexes, exporters and an end-to-end
+# scrape_url against a local stub server, all on the recorded pages in
+# bench/fixtures. Each scenario runs in a fresh process so peak RSS is its own.
+#
+#   python -m bench                       # all scenarios, results in bench/results/
+#   python -m bench --only parse --quick
+#   python -m bench --compare bench/results/<old>.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# URL "di origine" delle pagine registrate (decide quale adapter si applica)
+FIXTURE_URLS = {
+    "ta_single": "https://www.tripadvisor.it/Restaurant_Review-g187791-d1000001-Reviews-Rome_Lazio.html",
+    "ta_listing": "https://www.tripadvisor.it/Restaurants-g187791-Rome_Lazio.html",
+    "no_jsonld": "https://www.osteriadelborgo.it/",
+}
+
+def fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name + ".html"), encoding="utf-8") as f:
+        return f.read()
+
+def _peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    kb = resource.getrusage(who).ru_maxrss
+    return round((kb / 1024 if sys.platform == "darwin" else kb) / 1024, 1)
+
+def _summary(latencies: List[float], per_call: int, unit: str) -> dict:
+    lat = sorted(latencies)
+    n = len(lat)
+    total = sum(lat)
+    pct = lambda q: lat[min(n - 1, int(q * n))] * 1000
+    return {
+        "runs": n,
+        "unit": unit,
+        "per_sec": round(n * per_call / total, 2) if total else None,
+        "p50_ms": round(pct(0.50), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "mean_ms": round(total / n * 1000, 3),
+    }
+
+def _measure(fn: Callable[[], object], min_time: float, min_runs: int) -> List[float]:
+    fn()  # warm-up (import lazi, cache regex)
+    out: List[float] = []
+    start = time.perf_counter()
+    while len(out) < min_runs or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+# --------------------- scenari ---------------------
+
+def _parse(name: str):
+    from scraping.parsers import parse_entity
+    from scraping.site_adapters import adapter_syntaxes
+    html, url = fixture(name), FIXTURE_URLS[name]
+    syntaxes = adapter_syntaxes(url)
+    return lambda: parse_entity(html, url, syntaxes), 1, "pages"
+
+def _visible_text(name: str):
+    from scraping.parsers import _visible_text
+    html = fixture(name)
+    return lambda: _visible_text(html), 1, "pages"
+
+def _phones(name: str):
+    from scraping.parsers import _collect_phones, _visible_text
+    page = _visible_text(fixture(name))
+    return lambda: _collect_phones(page["text"], page["tel"]), 1, "pages"
+
+def _emails(name: str):
+    from scraping.parsers import _collect_emails, _visible_text
+    page = _visible_text(fixture(name))
+    return lambda: _collect_emails(page["text"], page["mailto"]), 1, "pages"
+
+# Input ostili per le regex di fallback: lunghe sequenze che con pattern non
+# ancorati causano backtracking quadratico. Il tempo deve crescere ~4x da 64k a 256k.
+_ADVERSARIAL = {
+    "letters": lambda n: "a" * n,
+    "dotted": lambda n: "a." * (n // 2) + "@",
+    "at_signs": lambda n: "a@" * (n // 2),
+    "digits": lambda n: "1" * n,
+    "spaced_digits": lambda n: "1 " * (n // 2),
+}
+
+def _adversarial(size: int):
+    from scraping.parsers import _collect_emails, _collect_phones
+    texts = [f(size) for f in _ADVERSARIAL.values()]
+
+    def run():
+        for t in texts:
+            _collect_emails(t)
+            _collect_phones(t)
+    return run, len(texts), "inputs"
+
+def _adversarial_page():
+    # 3 MB senza JSON-LD: script inline enorme + testo ostile, il fallback deve troncare
+    from scraping.parsers import parse_entity
+    html = ("<html><head><title>x</title><script>var d=\"" + "1@a." * 500_000 + "\";</script></head><body><p>"
+            + "1 " * 500_000 + "</p><a href=\"tel:+390612345678\">tel</a></body></html>")
+    return lambda: parse_entity(html, "https://example.com/"), 1, "pages"
+
+def _listing_items(copies: int = 1) -> List[dict]:
+    from scraping.parsers import parse_entity
+    items = parse_entity(fixture("ta_listing"), FIXTURE_URLS["ta_listing"])["items"]
+    return [dict(i) for _ in range(copies) for i in items]
+
+def _jsonld_items():
+    from scraping.parsers import _entity_from_jsonld_item, _extract_jsonld
+    url = FIXTURE_URLS["ta_listing"]
+    blocks = [li["item"] for b in _extract_jsonld(fixture("ta_listing")) if b.get("@type") == "ItemList"
+              for li in b["itemListElement"]]
+    return lambda: [_entity_from_jsonld_item(b, url) for b in blocks], len(blocks), "items"
+
+def _export_xlsx():
+    from app.exporters import write_xlsx
+    items = _listing_items(10)
+    return lambda: write_xlsx(items, FIXTURE_URLS["ta_listing"], io.BytesIO()), len(items), "items"
+
+def _export_json():
+    from models import entity_json
+    from app.exporters import iter_json
+    items, url = _listing_items(10), FIXTURE_URLS["ta_listing"]
+
+    def run():
+        # come /download.json e /api/scrape: item -> dict JSON senza rivalidazione, bytes a chunk
+        return b"".join(iter_json({"ok": True, "url": url}, "items", (entity_json(i, url) for i in items), {"errors": []}))
+    return run, len(items), "items"
+
+def _export_json_pydantic():
+    # riferimento: il percorso precedente (validazione Entity completa + json.dumps indentato)
+    from models import Entity
+    items, url = _listing_items(10), FIXTURE_URLS["ta_listing"]
+
+    def run():
+        payload = {"ok": True, "url": url, "errors": [],
+                   "items": [Entity(**{"source_url": url, **i}).model_dump(mode="json") for i in items]}
+        return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+    return run, len(items), "items"
+
+# Moduli pesanti che non devono essere caricati all'avvio (solo al primo uso)
+HEAVY_MODULES = ("selenium", "undetected_chromedriver", "openpyxl", "extruct", "rdflib", "fake_useragent", "pandas", "bs4")
+
+def _cold_import(code: str):
+    # avvio a freddo in un interprete nuovo: conta anche lo spawn di worker uvicorn / process pool
+    cmd = [sys.executable, "-c", code]
+    probe = code + "; import sys, json; print(json.dumps([m for m in %r if m in sys.modules]))" % (HEAVY_MODULES,)
+    loaded = json.loads(subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True,
+                                       check=True).stdout.strip().splitlines()[-1])
+    return lambda: subprocess.run(cmd, cwd=ROOT, check=True), 1, "starts", {"heavy_modules_loaded": loaded}
+
+SCENARIOS: Dict[str, Callable[[], tuple]] = {
+    "cold_import[app.main]": lambda: _cold_import("import app.main"),
+    "cold_import[parse worker]": lambda: _cold_import(
+        "from scraping.parse_executor import parse_page; parse_page('https://example.com/', '<html></html>')"),
+    "parse_entity[ta_single]": lambda: _parse("ta_single"),
+    "parse_entity[ta_listing]": lambda: _parse("ta_listing"),
+    "parse_entity[no_jsonld]": lambda: _parse("no_jsonld"),
+    "parse_entity[adversarial 3MB]": _adversarial_page,
+    "visible_text[no_jsonld]": lambda: _visible_text("no_jsonld"),
+    "visible_text[ta_listing]": lambda: _visible_text("ta_listing"),
+    "collect_phones[no_jsonld]": lambda: _phones("no_jsonld"),
+    "collect_emails[no_jsonld]": lambda: _emails("no_jsonld"),
+    "collect_emails[ta_listing]": lambda: _emails("ta_listing"),
+    "fallback_regex[adversarial 64k]": lambda: _adversarial(64 * 1024),
+    "fallback_regex[adversarial 256k]": lambda: _adversarial(256 * 1024),
+    "entity_from_jsonld_item[ta_listing]": _jsonld_items,
+    "export_xlsx[300 items]": _export_xlsx,
+    "export_json[300 items]": _export_json,
+    "export_json_pydantic[300 items]": _export_json_pydantic,
+}
+E2E = "scrape_url[stub server]"
+
+
+def _e2e(min_time: float, min_runs: int) -> dict:
+    # scrape_url completo (robots, fetch HTTP, parse nel process pool) contro un server locale
+    os.environ.update({"DISABLE_BROWSER": "1", "RESULT_CACHE_BACKEND": "off",
+                       "RATE_LIMIT_PER_HOST": "100000", "RATE_LIMIT_BURST": "1000"})
+    for k in ("HTTP_CACHE_DIR", "ENTITY_STORE_PATH", "HTTP_PROXY", "HTTPS_PROXY"):
+        os.environ.pop(k, None)
+    from bench.stub_server import serve
+    from scraping.runner import scrape_url
+    from scraping.http_client import close_client
+    from scraping.parse_executor import shutdown_parse_executor
+
+    srv, base = serve({"/" + name + ".html": fixture(name) for name in FIXTURE_URLS})
+    urls = [f"{base}/{name}.html" for name in FIXTURE_URLS]
+
+    async def main() -> List[float]:
+        for u in urls:  # warm-up: pool di processi, connessioni, robots.txt
+            await scrape_url(u, use_browser=False, use_cache=False)
+        out: List[float] = []
+        start = time.perf_counter()
+        while len(out) < min_runs or time.perf_counter() - start < min_time:
+            for u in urls:
+                t0 = time.perf_counter()
+                items, errors = await scrape_url(u, use_browser=False, use_cache=False)
+                out.append(time.perf_counter() - t0)
+                if errors:
+                    raise RuntimeError(f"{u}: {errors}")
+        await close_client()
+        return out
+
+    try:
+        latencies = asyncio.run(main())
+    finally:
+        shutdown_parse_executor()
+        srv.shutdown()
+    res = _summary(latencies, 1, "pages")
+    res["children_peak_rss_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return res
+
+def _run_scenario(name: str, min_time: float, min_runs: int) -> dict:
+    if name == E2E:
+        res = _e2e(min_time, min_runs)
+    else:
+        fn, per_call, unit, *extra = SCENARIOS[name]()
+        res = _summary(_measure(fn, min_time, min_runs), per_call, unit)
+        for e in extra:
+            res.update(e)
+    res["peak_rss_mb"] = _peak_rss_mb()
+    return res
+
+
+# --------------------- report ---------------------
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def _print_table(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None) -> None:
+    print(f"{'scenario':40} {'rate':>16} {'p50 ms':>10} {'p99 ms':>10} {'RSS MB':>8}" + ("  vs baseline" if baseline else ""))
+    for name, r in results.items():
+        line = (f"{name:40} {r['per_sec']:>10.1f} {r['unit'] + '/s':>5} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f}"
+                f" {r['peak_rss_mb']:>8.1f}")
+        old = (baseline or {}).get(name)
+        if old and old.get("per_sec"):
+            line += f"  {(r['per_sec'] / old['per_sec'] - 1) * 100:+.1f}% rate, {(r['p50_ms'] / old['p50_ms'] - 1) * 100:+.1f}% p50"
+        print(line)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench", description="Offline scraping benchmarks")
+    ap.add_argument("--only", action="append", default=[], help="run only scenarios containing this text (repeatable)")
+    ap.add_argument("--min-time", type=float, default=2.0, help="seconds per scenario (default 2)")
+    ap.add_argument("--min-runs", type=int, default=20)
+    ap.add_argument("--quick", action="store_true", help="0.3 s / 5 runs per scenario")
+    ap.add_argument("--output", help="JSON file to write (default bench/results/<timestamp>.json)")
+    ap.add_argument("--compare", help="previous results JSON to compare against")
+    args = ap.parse_args(argv)
+    if args.quick:
+        args.min_time, args.min_runs = 0.3, 5
+
+    names = [n for n in [*SCENARIOS, E2E] if not args.only or any(o in n for o in args.only)]
+    results: Dict[str, dict] = {}
+    ctx = get_context("spawn")
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+            results[name] = ex.submit(_run_scenario, name, args.min_time, args.min_runs).result()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    _print_table(results, baseline)
+
+    out = args.output or os.path.join(RESULTS, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "min_time": args.min_time,
+        "min_runs": args.min_runs,
+        "results": results,
+    }
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {out}")
+    return 0
@@ -0,0 +1,32 @@
+from __future__ import annotations
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+# Local HTTP server for the end-to-end benchmark: serves the recorded pages
+# with keep-alive, allows everything in robots.txt, 404 for the rest.
+
+def serve(pages: Dict[str, str]) -> Tuple[ThreadingHTTPServer, str]:
+    bodies = {path: html.encode("utf-8") for path, html in pages.items()}
+    bodies["/robots.txt"] = b"User-agent: *\nAllow: /\n"
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = bodies.get(self.path.split("?", 1)[0])
+            self.send_response(200 if body is not None else 404)
+            body = body if body is not None else b"not found"
+            ctype = "text/plain" if self.path == "/robots.txt" else "text/html; charset=utf-8"
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_port}"
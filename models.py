@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import Any, Callable, List, Optional, Dict
+from copy import copy
 from datetime import datetime
 
 class Entity(BaseModel):
@@ -20,3 +21,37 @@ class Entity(BaseModel):
     rating: Optional[float] = None
     data_quality: float = 0.0
     scraped_at: datetime = Field(default_factory=datetime.utcnow)
+
+def _default_maker(f) -> Callable[[], Any]:
+    if f.default_factory is not None:
+        return f.default_factory
+    d = None if f.is_required() else f.default
+    return (lambda: copy(d)) if isinstance(d, (list, dict)) else (lambda: d)
+
+# (campo, default) presi dal modello: un campo nuovo su Entity compare da solo
+# nelle risposte JSON
+_ENTITY_FIELDS = tuple((name, _default_maker(f)) for name, f in Entity.model_fields.items())
+_ENTITY_DATETIMES = tuple(name for name, f in Entity.model_fields.items() if f.annotation is datetime)
+
+def entity_json(item: Dict[str, Any], source_url: Optional[str] = None) -> Dict[str, Any]:
+    # Come Entity(**item).model_dump(mode="json"), stesse chiavi e stesso ordine, ma
+    # senza rivalidare: gli item arrivano dal nostro parser o dallo store, già tipizzati.
+    get = item.get
+    out = {name: v if (v := get(name)) is not None else default() for name, default in _ENTITY_FIELDS}
+    for name in _ENTITY_DATETIMES:
+        if isinstance(out[name], datetime):
+            out[name] = out[name].isoformat()
+    if not out["source_url"]:
+        out["source_url"] = source_url
+    if out["rating"] is not None:
+        out["rating"] = float(out["rating"])
+    out["data_quality"] = float(out["data_quality"] or 0.0)
+    return out
+
+class BatchScrapeRequest(BaseModel):
+    urls: List[str]
+    use_browser: bool = True
+    max_wait_ms: int = 2000
+    respect_robots: bool = True
+    crawl: bool = False
+    max_pages: Optional[int] = None
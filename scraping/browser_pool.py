@@ -0,0 +1,229 @@
+from __future__ import annotations
+import asyncio, threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Iterator, Optional
+from .fetchers import BrowserFetcher
+from .utils import env_int, env_float
+
+# Bounded pool of pre-launched headless browsers: drivers are checked out and
+# returned instead of paying a Chrome cold start for every browser fallback.
+
+class BrowserPoolClosed(RuntimeError):
+    pass
+
+
+class BrowserPool:
+    def __init__(self, size: Optional[int] = None, max_pages: Optional[int] = None,
+                 max_wait_ms: int = 2000, factory: Optional[Callable[[], BrowserFetcher]] = None,
+                 concurrency: Optional[int] = None, fetch_timeout: Optional[float] = None):
+        self.size = max(1, size or env_int("BROWSER_POOL_SIZE", 2))
+        self.max_pages = max(1, max_pages or env_int("BROWSER_MAX_PAGES", 50))
+        self.concurrency = max(1, min(self.size, concurrency or env_int("BROWSER_CONCURRENCY", self.size)))
+        self.fetch_timeout = fetch_timeout or env_float("BROWSER_FETCH_TIMEOUT", 60.0)
+        self._async_sem: Optional[asyncio.Semaphore] = None
+        self.max_wait_ms = max_wait_ms
+        self._factory = factory or (lambda: BrowserFetcher(max_wait_ms=self.max_wait_ms))
+        self._idle: Deque[BrowserFetcher] = deque()
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.launched = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.checkouts = 0
+        self.aborted = 0
+
+    def _launch(self) -> BrowserFetcher:
+        bf = self._factory()
+        try:
+            bf._ensure_driver()
+        except Exception:
+            bf.close()
+            raise
+        with self._cond:
+            self.launched += 1
+        return bf
+
+    def _discard(self, bf: BrowserFetcher) -> None:
+        try:
+            bf.close()
+        finally:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+
+    def warm(self, count: Optional[int] = None) -> int:
+        # pre-launch drivers up to `count` (default: the full pool size)
+        target = min(self.size, count if count is not None else self.size)
+        started = 0
+        while True:
+            with self._cond:
+                if self._closed or self._created >= target:
+                    return started
+                self._created += 1
+            try:
+                bf = self._launch()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                return started
+            self.release(bf, count_page=False)
+            started += 1
+
+    def acquire(self, timeout: Optional[float] = None) -> BrowserFetcher:
+        while True:
+            bf = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise BrowserPoolClosed("browser pool is closed")
+                    if self._idle:
+                        bf = self._idle.popleft()
+                        break
+                    if self._created < self.size:
+                        self._created += 1
+                        break
+                    if not self._cond.wait(timeout):
+                        raise TimeoutError("no browser available in pool")
+                self.checkouts += 1
+            if bf is None:
+                try:
+                    return self._launch()
+                except Exception:
+                    with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+            if bf.is_healthy():
+                return bf
+            # died while idle: replace it
+            with self._cond:
+                self.crashed += 1
+            self._discard(bf)
+
+    def release(self, bf: BrowserFetcher, broken: bool = False, count_page: bool = True) -> None:
+        if broken:
+            with self._cond:
+                self.crashed += 1
+            self._discard(bf)
+            return
+        if count_page and bf.pages >= self.max_pages:
+            with self._cond:
+                self.recycled += 1
+            self._discard(bf)
+            return
+        try:
+            bf.reset()
+        except Exception:
+            with self._cond:
+                self.crashed += 1
+            self._discard(bf)
+            return
+        with self._cond:
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                self._idle.append(bf)
+                self._cond.notify()
+        if closed:
+            self._discard(bf)
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[BrowserFetcher]:
+        bf = self.acquire(timeout)
+        try:
+            yield bf
+        except BaseException:
+            self._release_after_error(bf)
+            raise
+        self.release(bf)
+
+    def abort(self, bf: BrowserFetcher) -> None:
+        # called from outside the driver thread: quitting Chrome makes the
+        # pending page load fail, then the slot is freed
+        with self._cond:
+            self.aborted += 1
+        self._discard(bf)
+
+    def _release_when_acquired(self, fut: "asyncio.Future[BrowserFetcher]") -> None:
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        bf = fut.result()
+        bf.executor.submit(self.release, bf, False, False)
+
+    async def fetch(self, url: str, max_wait_ms: Optional[int] = None,
+                    timeout: Optional[float] = None) -> tuple[int, str]:
+        # async path: the event loop only awaits, Selenium runs on the driver's thread
+        timeout = timeout or self.fetch_timeout
+        if self._async_sem is None:
+            self._async_sem = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        async with self._async_sem:
+            acq = loop.run_in_executor(None, self.acquire, timeout)
+            try:
+                bf = await asyncio.shield(acq)
+            except asyncio.CancelledError:
+                acq.add_done_callback(self._release_when_acquired)
+                raise
+            fut = loop.run_in_executor(bf.executor, bf.fetch_sync, url, max_wait_ms)
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+            try:
+                result = await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                loop.run_in_executor(None, self.abort, bf)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise TimeoutError(f"browser fetch timed out after {timeout:g}s") from None
+                raise
+            except Exception:
+                await loop.run_in_executor(bf.executor, self._release_after_error, bf)
+                raise
+            await loop.run_in_executor(bf.executor, self.release, bf)
+            return result
+
+    def _release_after_error(self, bf: BrowserFetcher) -> None:
+        self.release(bf, broken=not bf.is_healthy())
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for bf in idle:
+            self._discard(bf)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "alive": self._created,
+                "idle": len(self._idle),
+                "in_use": self._created - len(self._idle),
+                "launched": self.launched,
+                "recycled": self.recycled,
+                "crashed": self.crashed,
+                "checkouts": self.checkouts,
+                "aborted": self.aborted,
+                "concurrency": self.concurrency,
+                "max_pages": self.max_pages,
+            }
+
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = BrowserPool()
+        return _pool
+
+def close_browser_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
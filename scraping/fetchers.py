@@ -1,47 +1,147 @@
 from __future__ import annotations
 import os, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-import httpx
-from .utils import randomized_headers, backoff_delay, build_proxy_kwargs
+from .utils import randomized_headers, backoff_delay, env_float, get_rate_limiter, parse_retry_after, HostRateLimiter
+from .http_client import SharedHttpClient, get_client
+from .http_cache import HttpCache, CachedResponse, get_http_cache
+from .metrics import stage, record_stage, HTTP_RETRIES, HTTP_RESPONSES, HTTP_BYTES
+from .site_adapters import adapter_ready_selector
+from .parsers import ALLOWED_TYPES
+
+def _request_headers(entry: Optional[CachedResponse]) -> dict:
+    h = randomized_headers()
+    if entry is not None:
+        # revalidate instead of forcing a full download
+        h.pop("Cache-Control", None)
+        h.pop("Pragma", None)
+        h.update(entry.validators())
+    return h
 
 class HttpFetcher:
-    def __init__(self, max_retries: int = 3, max_wait_ms: int = 2000):
+    def __init__(self, max_retries: int = 3, client: Optional[SharedHttpClient] = None,
+                 limiter: Optional[HostRateLimiter] = None, cache: Optional[HttpCache] = None):
         self.max_retries = max_retries
-        self.max_wait_ms = max_wait_ms
+        self.client = client
+        self.limiter = limiter
+        self.cache = cache
+        self.max_retry_after = env_float("RATE_LIMIT_MAX_RETRY_AFTER", 60.0)
+
+    async def _from_cache(self, cache: HttpCache, entry: Optional[CachedResponse]) -> Optional[str]:
+        return await asyncio.to_thread(cache.read, entry) if entry is not None else None
+
+    async def _backoff(self, attempt: int) -> None:
+        delay = backoff_delay(attempt)
+        await asyncio.sleep(delay)
+        record_stage("http_backoff", delay)
 
     async def fetch(self, url: str) -> tuple[int, str]:
-        async with httpx.AsyncClient(http2=True, timeout=20, **build_proxy_kwargs()) as client:
-            last_exc: Optional[Exception] = None
-            for i in range(self.max_retries):
-                try:
-                    r = await client.get(url, headers=randomized_headers())
-                    if r.status_code in (200, 201):
-                        await asyncio.sleep(self.max_wait_ms / 1000.0)
-                        return r.status_code, r.text
-                    if r.status_code in (403, 429, 500, 502, 503):
-                        await asyncio.sleep(backoff_delay(i))
-                        continue
+        client = self.client or get_client()
+        limiter = self.limiter or get_rate_limiter()
+        cache = self.cache or get_http_cache()
+        entry = await asyncio.to_thread(cache.lookup, url) if cache is not None else None
+        if cache is not None and cache.offline:
+            text = await self._from_cache(cache, entry)
+            if text is None:
+                cache.misses += 1
+                raise RuntimeError(f"offline mode: {url} is not in the HTTP cache")
+            cache.hits += 1
+            return 200, text
+        last_exc: Optional[Exception] = None
+        for i in range(self.max_retries):
+            try:
+                # politeness is paid before the request, never after a response is in hand
+                with stage("rate_limit"):
+                    await limiter.wait(url)
+                r = await client.get(url, headers=_request_headers(entry))
+                HTTP_RESPONSES.inc(1, str(r.status_code))
+                HTTP_BYTES.inc(len(r.content))
+                if r.status_code == 304 and entry is not None:
+                    text = await self._from_cache(cache, entry)
+                    if text is not None:
+                        cache.revalidated += 1
+                        return 200, text
+                    entry = None  # object lost on disk: ask again without validators
+                    continue
+                if r.status_code in (200, 201):
+                    if cache is not None:
+                        cache.misses += 1
+                        try:
+                            await asyncio.to_thread(cache.store, url, r.content, r.encoding,
+                                                    r.headers.get("etag"), r.headers.get("last-modified"))
+                        except Exception:
+                            pass
                     return r.status_code, r.text
-                except Exception as e:
-                    last_exc = e
-                    await asyncio.sleep(backoff_delay(i))
-            if last_exc:
-                raise last_exc
-            raise RuntimeError("Fetch failed without exception")
+                if r.status_code in (429, 503):
+                    retry_after = parse_retry_after(r.headers.get("retry-after"))
+                    if retry_after is not None:
+                        limiter.block(url, retry_after)
+                        if retry_after > self.max_retry_after:
+                            return r.status_code, r.text
+                        HTTP_RETRIES.inc(1, str(r.status_code))
+                        continue
+                if r.status_code in (403, 429, 500, 502, 503):
+                    HTTP_RETRIES.inc(1, str(r.status_code))
+                    await self._backoff(i)
+                    continue
+                return r.status_code, r.text
+            except Exception as e:
+                last_exc = e
+                HTTP_RETRIES.inc(1, "error")
+                await self._backoff(i)
+        if last_exc:
+            raise last_exc
+        raise RuntimeError("Fetch failed without exception")
 
 # --------------------- Selenium headless ---------------------
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver import ChromeOptions
+# selenium / undetected_chromedriver are imported on first browser use: the
+# HTTP-only path (and every parse worker) never pays for them.
+
+# Lean mode: only the HTML and its scripts matter (we consume JSON-LD), so
+# images, fonts, media and ad/tracker hosts are blocked via CDP.
+_BLOCKED_RESOURCES = [
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*",
+    "*.woff*", "*.woff2*", "*.ttf*", "*.otf*", "*.eot*",
+    "*.mp4*", "*.webm*", "*.m3u8*", "*.mp3*", "*.ogg*",
+]
+_BLOCKED_HOSTS = [
+    "googletagmanager.com", "google-analytics.com", "googlesyndication.com", "googleadservices.com",
+    "doubleclick.net", "adservice.google.com", "connect.facebook.net", "scorecardresearch.com",
+    "criteo.com", "criteo.net", "adnxs.com", "amazon-adsystem.com", "taboola.com", "outbrain.com",
+    "hotjar.com", "quantserve.com", "moatads.com", "pubmatic.com", "rubiconproject.com",
+    "casalemedia.com", "openx.net", "demdex.net", "omtrdc.net", "bat.bing.com", "clarity.ms",
+]
+
+# Ready as soon as the data we parse is in the DOM: the adapter selector if
+# any, else a JSON-LD ItemList / place block; at worst the load event.
+_READY_JS = """
+var sel = arguments[0], types = arguments[1];
+if (sel) { if (document.querySelector(sel)) return true; }
+else {
+  var blocks = document.querySelectorAll('script[type="application/ld+json"]');
+  for (var i = 0; i < blocks.length; i++) {
+    var t = blocks[i].textContent || "";
+    if (t.indexOf('"ItemList"') >= 0) return true;
+    for (var j = 0; j < types.length; j++) if (t.indexOf('"' + types[j] + '"') >= 0) return true;
+  }
+}
+return document.readyState === "complete";
+"""
+
+def _lean_default() -> bool:
+    return os.getenv("BROWSER_LEAN", "1").lower() not in ("0", "false", "no")
 
 class BrowserFetcher:
-    def __init__(self, max_wait_ms: int = 2000):
+    def __init__(self, max_wait_ms: int = 2000, lean: Optional[bool] = None):
         self.max_wait_ms = max_wait_ms
+        self.lean = _lean_default() if lean is None else lean
         self._driver = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pages = 0
 
     def _build_driver(self):
+        import undetected_chromedriver as uc
+        from selenium.webdriver import ChromeOptions
         opts = ChromeOptions()
         opts.add_argument("--headless=new")
         opts.add_argument("--disable-gpu")
@@ -52,34 +152,124 @@ class BrowserFetcher:
         proxy = os.getenv("HTTP_PROXY") or os.getenv("HTTPS_PROXY")
         if proxy:
             opts.add_argument(f"--proxy-server={proxy}")
-        return uc.Chrome(options=opts)
+        if self.lean:
+            # get() returns at DOMContentLoaded; readiness is decided in fetch_sync
+            opts.page_load_strategy = "eager"
+            opts.add_argument("--blink-settings=imagesEnabled=false")
+            opts.add_argument("--mute-audio")
+            opts.add_argument("--disable-extensions")
+            opts.add_argument("--disable-background-networking")
+            opts.add_argument("--disable-features=Translate,MediaRouter,OptimizationHints")
+        driver = uc.Chrome(options=opts)
+        if self.lean:
+            self._block_resources(driver)
+        return driver
+
+    @staticmethod
+    def _block_resources(driver) -> None:
+        extra = [p.strip() for p in os.getenv("BROWSER_BLOCK_URLS", "").split(",") if p.strip()]
+        patterns = _BLOCKED_RESOURCES + [f"*{h}*" for h in _BLOCKED_HOSTS] + extra
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        except Exception:
+            pass  # no CDP (remote driver): still works, just loads everything
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # drivers are not thread-safe: all work on one driver runs on its own thread
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="browser")
+        return self._executor
 
     def _ensure_driver(self):
         if self._driver is None:
             self._driver = self._build_driver()
 
+    def is_healthy(self) -> bool:
+        if self._driver is None:
+            return False
+        try:
+            return self._driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _frame_origins(tree: dict) -> set:
+        origins = {tree["frame"].get("securityOrigin")}
+        for child in tree.get("childFrames", ()):
+            origins |= BrowserFetcher._frame_origins(child)
+        return {o for o in origins if o and o.startswith("http")}
+
+    def reset(self) -> None:
+        # wipe state left by the previous page before handing the driver out again.
+        # Via CDP: all cookies (third-party too) and the storage of every origin
+        # loaded in the page, iframes included
+        d = self._driver
+        if d is None:
+            return
+        try:
+            # sessionStorage belongs to the tab, CDP storage types do not cover it
+            d.execute_script("try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}")
+        except Exception:
+            pass
+        try:
+            tree = d.execute_cdp_cmd("Page.getFrameTree", {})["frameTree"]
+            for origin in self._frame_origins(tree):
+                d.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+            d.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        except Exception:
+            d.delete_all_cookies()  # no CDP (remote driver): only the current document's cookies
+        d.get("about:blank")
+
     def close(self) -> None:
         try:
             if self._driver:
                 self._driver.quit()
         finally:
             self._driver = None
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
 
-    def fetch_sync(self, url: str) -> tuple[int, str]:
+    def fetch_sync(self, url: str, max_wait_ms: Optional[int] = None) -> tuple[int, str]:
         self._ensure_driver()
         d = self._driver
+        wait_ms = max_wait_ms if max_wait_ms is not None else self.max_wait_ms
+        self.pages += 1
+        if self.lean:
+            return 200, self._fetch_lean(d, url, wait_ms)
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
         d.get(url)
         try:
-            WebDriverWait(d, max(1, self.max_wait_ms // 1000)).until(
+            WebDriverWait(d, max(1, wait_ms // 1000)).until(
                 lambda drv: drv.execute_script("return document.readyState") == "complete"
             )
         except Exception:
             pass
         try:
-            WebDriverWait(d, min(5, max(1, self.max_wait_ms // 1000))).until(
+            WebDriverWait(d, min(5, max(1, wait_ms // 1000))).until(
                 EC.presence_of_element_located((By.TAG_NAME, "body"))
             )
         except Exception:
             pass
         html = d.page_source or ""
         return 200, html
+
+    def _fetch_lean(self, d, url: str, wait_ms: int) -> str:
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.ui import WebDriverWait
+        try:
+            d.get(url)
+        except TimeoutException:
+            pass  # page load timeout: whatever arrived may already hold the data
+        types = sorted(ALLOWED_TYPES)
+        try:
+            WebDriverWait(d, max(1, wait_ms / 1000), poll_frequency=0.1).until(
+                lambda drv: drv.execute_script(_READY_JS, adapter_ready_selector(url), types)
+            )
+        except TimeoutException:
+            pass
+        return d.page_source or ""
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import gzip, hashlib, os, sqlite3, threading, time
+from typing import Optional
+from w3lib.url import canonicalize_url
+from .utils import env_int
+
+# On-disk HTTP response cache: gzip bodies stored by content hash, validators
+# (ETag / Last-Modified) in a SQLite index, LRU eviction over a byte budget.
+# With offline=True pages are served only from the cache (parser replays).
+
+class CachedResponse:
+    __slots__ = ("url", "etag", "last_modified", "encoding", "body_hash", "size")
+
+    def __init__(self, url, etag, last_modified, encoding, body_hash, size):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.encoding = encoding
+        self.body_hash = body_hash
+        self.size = size
+
+    def validators(self) -> dict:
+        h = {}
+        if self.etag:
+            h["If-None-Match"] = self.etag
+        if self.last_modified:
+            h["If-Modified-Since"] = self.last_modified
+        return h
+
+
+class HttpCache:
+    def __init__(self, directory: str, max_bytes: Optional[int] = None, offline: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes or env_int("HTTP_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+        self.offline = offline
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, encoding TEXT, "
+                         "body_hash TEXT NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_body ON responses(body_hash)")
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(url: str) -> str:
+        try:
+            return canonicalize_url(url)
+        except Exception:
+            return url
+
+    def _object_path(self, body_hash: str) -> str:
+        return os.path.join(self.directory, "objects", body_hash[:2], body_hash + ".gz")
+
+    def lookup(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._db.execute("SELECT url, etag, last_modified, encoding, body_hash, size FROM responses WHERE url = ?",
+                                   (self._key(url),)).fetchone()
+        return CachedResponse(*row) if row else None
+
+    def read(self, entry: CachedResponse) -> Optional[str]:
+        try:
+            with gzip.open(self._object_path(entry.body_hash), "rb") as f:
+                body = f.read()
+        except OSError:
+            with self._lock:
+                self._db.execute("DELETE FROM responses WHERE url = ?", (entry.url,))
+            return None
+        with self._lock:
+            self._db.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), entry.url))
+        return body.decode(entry.encoding or "utf-8", errors="replace")
+
+    def store(self, url: str, body: bytes, encoding: Optional[str], etag: Optional[str], last_modified: Optional[str]) -> None:
+        body_hash = hashlib.sha256(body).hexdigest()
+        path = self._object_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(body)
+            os.replace(tmp, path)
+        size = os.path.getsize(path)
+        now = time.time()
+        key = self._key(url)
+        with self._lock:
+            prev = self._db.execute("SELECT body_hash FROM responses WHERE url = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (key, etag, last_modified, encoding, body_hash, size, now, now))
+            # body changed: the old object is orphaned unless another URL shares it
+            orphan = (prev is not None and prev[0] != body_hash and
+                      self._db.execute("SELECT 1 FROM responses WHERE body_hash = ? LIMIT 1", (prev[0],)).fetchone() is None)
+        if orphan:
+            try:
+                os.remove(self._object_path(prev[0]))
+            except OSError:
+                pass
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            # identical bodies share one object: count each object once
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM "
+                                     "(SELECT size FROM responses GROUP BY body_hash)").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - self.max_bytes
+            doomed = []
+            for url, body_hash, size in self._db.execute("SELECT url, body_hash, size FROM responses ORDER BY accessed").fetchall():
+                if excess <= 0:
+                    break
+                self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                if self._db.execute("SELECT 1 FROM responses WHERE body_hash = ? LIMIT 1", (body_hash,)).fetchone() is None:
+                    doomed.append(body_hash)
+                    excess -= size
+        for h in doomed:
+            try:
+                os.remove(self._object_path(h))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            n, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"directory": self.directory, "entries": n, "bytes": size, "max_bytes": self.max_bytes,
+                "offline": self.offline, "hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_cache: Optional[HttpCache] = None
+_cache_lock = threading.Lock()
+
+def get_http_cache() -> Optional[HttpCache]:
+    # HTTP_CACHE_DIR abilita la cache; HTTP_CACHE_OFFLINE=1 serve solo dalla cache
+    global _cache
+    directory = os.getenv("HTTP_CACHE_DIR")
+    if not directory:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache(directory, offline=os.getenv("HTTP_CACHE_OFFLINE", "").lower() in ("1", "true", "yes"))
+        return _cache
+
+def close_http_cache() -> None:
+    global _cache
+    with _cache_lock:
+        cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+import asyncio, weakref
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import httpx
+from .utils import build_proxy_kwargs, env_int, env_float
+
+# One long-lived AsyncClient per process: TCP/TLS/HTTP2 sessions are reused
+# across scrapes instead of being rebuilt for every URL.
+
+class SharedHttpClient:
+    def __init__(self,
+                 max_connections: Optional[int] = None,
+                 max_keepalive: Optional[int] = None,
+                 keepalive_expiry: Optional[float] = None,
+                 per_host: Optional[int] = None,
+                 timeout: float = 20.0):
+        self.max_connections = max_connections or env_int("HTTP_POOL_MAX_CONNECTIONS", 100)
+        self.max_keepalive = max_keepalive or env_int("HTTP_POOL_MAX_KEEPALIVE", 20)
+        self.keepalive_expiry = keepalive_expiry or env_float("HTTP_POOL_KEEPALIVE_EXPIRY", 30.0)
+        self.per_host = per_host or env_int("HTTP_POOL_PER_HOST", 6)
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_sems: Dict[str, asyncio.Semaphore] = {}
+        self._seen = weakref.WeakSet()
+        self.requests = 0
+        self.connections_opened = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_keepalive,
+                                  keepalive_expiry=self.keepalive_expiry)
+            self._client = httpx.AsyncClient(http2=True, timeout=self.timeout, limits=limits,
+                                             **build_proxy_kwargs())
+        return self._client
+
+    def _host_sem(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        sem = self._host_sems.get(host)
+        if sem is None:
+            sem = self._host_sems[host] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        async with self._host_sem(url):
+            r = await self.client.get(url, **kwargs)
+        self.requests += 1
+        self._track_connections()
+        return r
+
+    def _pools(self):
+        if self._client is None:
+            return []
+        transports = [self._client._transport, *self._client._mounts.values()]
+        return [p for p in (getattr(t, "_pool", None) for t in transports if t is not None) if p is not None]
+
+    def _track_connections(self) -> None:
+        for pool in self._pools():
+            for conn in pool.connections:
+                if conn not in self._seen:
+                    self._seen.add(conn)
+                    self.connections_opened += 1
+
+    def stats(self) -> dict:
+        conns = [c for p in self._pools() for c in p.connections if not c.is_closed()]
+        idle = sum(1 for c in conns if c.is_idle())
+        reused = max(0, self.requests - self.connections_opened)
+        return {
+            "open_connections": len(conns),
+            "idle_connections": idle,
+            "active_connections": len(conns) - idle,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+            "limits": {
+                "max_connections": self.max_connections,
+                "max_keepalive": self.max_keepalive,
+                "keepalive_expiry": self.keepalive_expiry,
+                "per_host": self.per_host,
+            },
+        }
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._host_sems.clear()
+
+
+_shared: Optional[SharedHttpClient] = None
+
+def get_client() -> SharedHttpClient:
+    global _shared
+    if _shared is None:
+        _shared = SharedHttpClient()
+    return _shared
+
+async def start_client() -> SharedHttpClient:
+    c = get_client()
+    c.client  # open the pool eagerly at startup
+    return c
+
+async def close_client() -> None:
+    global _shared
+    if _shared is not None:
+        await _shared.aclose()
+    _shared = None
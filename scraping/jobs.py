@@ -0,0 +1,182 @@
+from __future__ import annotations
+import asyncio, time, uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from .runner import scrape_urls
+from .utils import env_int
+
+# Background scrape jobs: submit URLs, get an id, poll or subscribe to
+# progress. A fixed number of asyncio workers drain a bounded queue, so a
+# full queue pushes back on clients instead of overloading the box.
+
+class JobQueueFull(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(self, urls: List[str], use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                 crawl: bool = False, max_pages: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.urls = list(dict.fromkeys(s for s in (str(u).strip() for u in urls) if s))
+        self.options = {"use_browser": use_browser, "max_wait_ms": max_wait_ms, "respect_robots": respect_robots,
+                        "crawl": crawl, "max_pages": max_pages}
+        self.status = "queued"  # queued | running | done | cancelled | failed
+        self.results: Dict[str, dict] = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.version = 0  # incremented on every change
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "cancelled", "failed")
+
+    def _notify(self) -> None:
+        self.version += 1
+        ev, self._changed = self._changed, asyncio.Event()
+        ev.set()
+
+    async def wait_changed(self, seen: int, timeout: float) -> bool:
+        # True as soon as the job moved past version `seen`, even if that
+        # happened before the call (the subscriber was busy sending)
+        if self.version != seen:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def items(self) -> List[dict]:
+        return [i for u in self.urls if u in self.results for i in self.results[u]["items"]]
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.urls),
+            "done": len(self.results),
+            "items": sum(len(r["items"]) for r in self.results.values()),
+            "errors": sum(len(r["errors"]) for r in self.results.values()),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    def __init__(self, workers: Optional[int] = None, max_queued: Optional[int] = None, max_jobs: Optional[int] = None):
+        self.workers = max(1, workers or env_int("JOB_WORKERS", 2))
+        self.max_queued = max(1, max_queued or env_int("JOB_MAX_QUEUED", 100))
+        self.max_jobs = max(1, max_jobs or env_int("JOB_MAX_KEPT", 1000))
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._stopping = False
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for job in self._jobs.values():
+            if not job.finished:
+                self.cancel(job.id)
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, job: Job) -> Job:
+        self.start()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"job queue is full ({self.max_queued} queued)")
+        self._jobs[job.id] = job
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job._task is not None:
+            job._task.cancel()  # running: _run marks it cancelled
+        else:
+            job.status = "cancelled"  # still queued: the worker will skip it
+            job.finished_at = time.time()
+            job._notify()
+        return job
+
+    def _prune(self) -> None:
+        # drop the oldest finished jobs beyond max_jobs
+        excess = len(self._jobs) - self.max_jobs
+        for jid in [j.id for j in self._jobs.values() if j.finished][:max(0, excess)]:
+            del self._jobs[jid]
+
+    async def _run(self, job: Job) -> None:
+        async for url, items, errors in scrape_urls(job.urls, **job.options):
+            job.results[url] = {"items": [{"source_url": url, **i} for i in items], "errors": errors}
+            job._notify()
+
+    async def _worker(self) -> None:
+        while True:
+            job: Job = await self._queue.get()
+            try:
+                if job.finished:
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                job._notify()
+                job._task = asyncio.ensure_future(self._run(job))
+                try:
+                    await job._task
+                    job.status = "done"
+                except asyncio.CancelledError:
+                    job.status = "cancelled"
+                    if self._stopping or not job._task.cancelled():
+                        job._task.cancel()
+                        raise  # the worker itself is being stopped
+                except Exception as e:
+                    job.status = "failed"
+                    job.error = str(e)
+                finally:
+                    job.finished_at = time.time()
+                    job._task = None
+                    job._notify()
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        by_status: Dict[str, int] = {}
+        for j in self._jobs.values():
+            by_status[j.status] = by_status.get(j.status, 0) + 1
+        return {"workers": self.workers, "queued": self._queue.qsize() if self._queue else 0,
+                "max_queued": self.max_queued, "jobs": by_status}
+
+
+_manager: Optional[JobManager] = None
+
+def get_job_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        _manager = JobManager()
+    return _manager
+
+async def stop_job_manager() -> None:
+    global _manager
+    if _manager is not None:
+        await _manager.stop()
+    _manager = None
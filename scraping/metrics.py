@@ -0,0 +1,166 @@
+from __future__ import annotations
+import bisect, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Minimal Prometheus-style metrics (text exposition format 0.0.4) plus
+# per-request stage timings for the Server-Timing header. Nothing runs in the
+# background: when no scrape is in flight there is no overhead.
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, v in items:
+            yield f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_value(v)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = _DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts..., sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for labels, s in items:
+            acc = 0.0
+            for b, n in zip(self.buckets, s):
+                acc += n
+                le = f'le="{b}"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {_fmt_value(acc)}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {_fmt_value(s[-1])}"
+            yield f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {_fmt_value(s[-2])}"
+            yield f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {_fmt_value(s[-1])}"
+
+
+# Collectors return (name, type, help, [(labels dict, value), ...]) computed at
+# scrape time, e.g. cache hit/miss counters already kept by the caches.
+Collected = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Collected]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, fn: Callable[[], Iterable[Collected]]) -> None:
+        if fn not in self._collectors:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        for fn in self._collectors:
+            try:
+                collected = list(fn())
+            except Exception:
+                continue
+            for name, typ, help, samples in collected:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {typ}")
+                for labels, v in samples:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_fmt_labels(names, tuple(labels[n] for n in names))} {_fmt_value(v)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "scrape_stage_seconds", "Time spent per scrape pipeline stage", ["stage"]))
+HTTP_RETRIES = REGISTRY.register(Counter(
+    "scrape_http_retries_total", "HTTP attempts retried, by status code (or 'error')", ["status"]))
+HTTP_RESPONSES = REGISTRY.register(Counter(
+    "scrape_http_responses_total", "HTTP responses received, by status code", ["status"]))
+HTTP_BYTES = REGISTRY.register(Counter(
+    "scrape_http_bytes_total", "Response body bytes downloaded"))
+PAGES = REGISTRY.register(Counter(
+    "scrape_pages_total", "Pages parsed, by fetcher that produced the HTML", ["fetcher"]))
+BROWSER_FALLBACKS = REGISTRY.register(Counter(
+    "scrape_browser_fallbacks_total", "Scrapes that fell back to the headless browser"))
+ITEMS_PER_PAGE = REGISTRY.register(Histogram(
+    "scrape_items_per_page", "Entities extracted per parsed page", [],
+    buckets=(0, 1, 2, 5, 10, 20, 30, 50, 100, 200, 500)))
+
+
+# --------------------- Server-Timing ---------------------
+
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def start_request_timings() -> Dict[str, float]:
+    # the dict is shared by every task spawned from the request (contextvars are copied, the dict is not)
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+def record_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - t0)
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in timings.items())
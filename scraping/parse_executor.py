@@ -0,0 +1,86 @@
+from __future__ import annotations
+import asyncio, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+from .parsers import parse_entity
+from .site_adapters import apply_adapters, adapter_syntaxes
+from .utils import env_int
+from .metrics import record_stage
+
+# Adapters + parse_entity are CPU bound: run them in a process pool so a heavy
+# page does not block the event loop. Raw HTML goes in, plain dicts come out.
+
+def parse_page(url: str, html: str) -> List[dict]:
+    html = apply_adapters(url, html)
+    return parse_entity(html, url, adapter_syntaxes(url))["items"]
+
+def _parse_page_timed(url: str, html: str) -> Tuple[List[dict], float, float]:
+    # i tempi vengono misurati nel worker e registrati nel processo principale
+    t0 = time.perf_counter()
+    html = apply_adapters(url, html)
+    t1 = time.perf_counter()
+    items = parse_entity(html, url, adapter_syntaxes(url))["items"]
+    return items, t1 - t0, time.perf_counter() - t1
+
+
+class ParseExecutor:
+    def __init__(self, mode: Optional[str] = None, workers: Optional[int] = None,
+                 max_tasks_per_child: Optional[int] = None):
+        # PARSE_EXECUTOR: process (default) | inline
+        self.mode = (mode or os.getenv("PARSE_EXECUTOR") or "process").lower()
+        self.workers = max(1, workers or env_int("PARSE_WORKERS", os.cpu_count() or 1))
+        # 0 disables recycling
+        if max_tasks_per_child is None:
+            max_tasks_per_child = env_int("PARSE_MAX_TASKS_PER_CHILD", 200)
+        self.max_tasks_per_child = max(0, max_tasks_per_child)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # max_tasks_per_child recycles workers to contain leaks in lxml/extruct;
+            # the argument only exists on Python 3.11+, older versions keep the workers
+            kwargs = {}
+            if self.max_tasks_per_child >= 1 and sys.version_info >= (3, 11):
+                kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, **kwargs)
+        return self._pool
+
+    async def parse(self, url: str, html: str) -> List[dict]:
+        t0 = time.perf_counter()
+        if self.mode == "inline":
+            items, t_adapt, t_parse = _parse_page_timed(url, html)
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                items, t_adapt, t_parse = await loop.run_in_executor(self.pool, _parse_page_timed, url, html)
+            except BrokenProcessPool:
+                # a worker died (OOM, segfault): start a fresh pool for the next calls
+                self.shutdown()
+                raise
+        record_stage("adapters", t_adapt)
+        record_stage("parse", t_parse)
+        # include pickling + queueing when the work ran in another process
+        record_stage("parse_total", time.perf_counter() - t0)
+        return items
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_executor: Optional[ParseExecutor] = None
+
+def get_parse_executor() -> ParseExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ParseExecutor()
+    return _executor
+
+def shutdown_parse_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+    _executor = None
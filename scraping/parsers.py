@@ -1,47 +1,190 @@
 from __future__ import annotations
-import json, re, html, unicodedata
-from typing import Dict, List, Optional, Any
-from bs4 import BeautifulSoup
-import extruct
+import json, os, re, html, unicodedata
+from typing import Dict, List, Optional, Any, Iterable
+import lxml.html
+from lxml import etree
 from w3lib.html import get_base_url
-from urllib.parse import urljoin
+from urllib.parse import urljoin, unquote
 
-from .utils import is_pec_email
+from .utils import is_pec_email, env_int
 
-# Regex di fallback
-_EMAIL_RE = re.compile(r"[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}", re.IGNORECASE)
-_PHONE_RE = re.compile(r"(?:(?:\+|00)\d{1,3}[\s.-]?)?(?:\(?\d{2,4}\)?[\s.-]?)?\d{3,4}[\s.-]?\d{3,4}")
+# Regex di fallback, a tempo lineare: ogni match può iniziare solo all'inizio di
+# una sequenza (lookbehind negativo) e tutte le ripetizioni sono limitate, quindi
+# niente backtracking quadratico su sequenze lunghe di lettere/cifre.
+_EMAIL_RE = re.compile(r"(?<![A-Z0-9._%+-])[A-Z0-9._%+-]{1,64}@[A-Z0-9-]{1,63}(?:\.[A-Z0-9-]{1,63}){0,8}\.[A-Z]{2,24}(?![A-Z0-9-])",
+                       re.IGNORECASE)
+# gruppi di cifre separati da un solo carattere: la suddivisione è univoca
+_PHONE_RE = re.compile(r"(?<![\w+])(?:\+|00)?(?:\(\d+\)|\d+)(?:[ .\-\u00a0](?:\(\d+\)|\d+)){0,6}")
+_DATE_RE = re.compile(r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}")
+_PHONE_CONTEXT_RE = re.compile(r"(?:iva|vat|c\.?\s?f|cod\.?|fisc|rea|cap)\W*$", re.IGNORECASE)
+
+# Limiti del fallback: oltre, la pagina viene troncata (pagine da MB non sono contatti)
+FALLBACK_MAX_TEXT = env_int("FALLBACK_MAX_TEXT", 256 * 1024)
+_INVISIBLE_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "object")
+
+# Per paese (default IT): prefisso internazionale, se lo 0 nazionale fa parte
+# del numero, cifre iniziali ammesse per i numeri nazionali (None = tutte),
+# numero massimo di cifre del numero nazionale (0 compreso)
+PHONE_DEFAULT_REGION = (os.getenv("PHONE_DEFAULT_REGION") or "IT").upper()
+_PHONE_REGIONS = {
+    "IT": ("39", True, "038", 11), "SM": ("378", True, "05", 10), "VA": ("39", True, "03", 11),
+    "FR": ("33", False, "0", 10), "DE": ("49", False, "01", 13), "AT": ("43", False, "0", 13),
+    "CH": ("41", False, "0", 10), "GB": ("44", False, "0", 11), "ES": ("34", True, "6789", 9),
+    "PT": ("351", True, "29", 9), "NL": ("31", False, "0", 10), "BE": ("32", False, "0", 10),
+    "US": ("1", True, None, 10), "CA": ("1", True, None, 10),
+}
+_PHONE_SEP_RE = re.compile(r"[ .\-\u00a0]")
+_PHONE_TAIL_RE = re.compile(r"(?:[ .\-\u00a0]\d)+$")
+
+# Blocchi JSON-LD: scansione diretta, senza costruire un albero DOM
+_JSONLD_RE = re.compile(r"""<script\b[^>]*\btype\s*=\s*["']?application/ld\+json["']?[^>]*>(.*?)</script\s*>""", re.IGNORECASE | re.DOTALL)
+_COMMENTLINE_RE = re.compile(r"^\s*(//.*|<!--.*-->)", re.MULTILINE)
+
+# Sintassi di default: solo JSON-LD. Gli adapter possono aggiungere "microdata"/"opengraph"
+DEFAULT_SYNTAXES = ("json-ld",)
 
 # Tipi schema.org che teniamo come "entity" valida
 ALLOWED_TYPES = {"Restaurant", "FoodEstablishment", "LocalBusiness", "Hotel", "LodgingBusiness"}
 
+_WS_RE = re.compile(r"\s+")
+_RESTAURANT = {"Restaurant"}
+
 def _clean_text(s: Optional[str]) -> Optional[str]:
     if not s:
         return None
-    # converti entità HTML & unicode escapes visive (\u0027)
-    s = s.replace("\\u0027", "'").replace("\\u0026", "&")
-    s = html.unescape(s)
-    s = unicodedata.normalize("NFKC", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    # converti entità HTML & unicode escapes visive (\u0027); ogni passo solo se serve
+    if "\\u" in s:
+        s = s.replace("\\u0027", "'").replace("\\u0026", "&")
+    if "&" in s:
+        s = html.unescape(s)
+    if not s.isascii():
+        s = unicodedata.normalize("NFKC", s)
+    s = _WS_RE.sub(" ", s).strip()
     return s or None
 
-def _collect_emails(html_text: str) -> List[str]:
-    raw = set(m.group(0) for m in _EMAIL_RE.finditer(html_text))
-    return sorted([e for e in raw if not is_pec_email(e) and not e.lower().startswith("no-reply")])
-
-def _collect_phones(text: str) -> List[str]:
-    raw = set(m.group(0) for m in _PHONE_RE.finditer(text))
-    out: List[str] = []
-    for p in raw:
-        # normalizza ma mantieni il formato umano in output
-        digits = re.sub(r"\D", "", p)
-        if len(digits) >= 7:
-            out.append(_clean_text(p) or p)
-    return sorted(set(out))
-
-def _extract_structured(html_doc: str, url: str) -> Dict[str, Any]:
+def _collect_emails(text: str, mailto: Iterable[str] = ()) -> List[str]:
+    raw = set(m.group(0) for m in _EMAIL_RE.finditer(text[:FALLBACK_MAX_TEXT]))
+    for href in mailto:
+        addr = unquote(href.split(":", 1)[-1].split("?", 1)[0]).strip()
+        if _EMAIL_RE.fullmatch(addr):
+            raw.add(addr)
+    # dedup case-insensitive, tenendo la prima forma vista in ordine alfabetico
+    out: Dict[str, str] = {}
+    for e in sorted(raw):
+        if not is_pec_email(e) and not e.lower().startswith("no-reply"):
+            out.setdefault(e.lower(), e)
+    return sorted(out.values())
+
+def normalize_phone(raw: str, region: Optional[str] = None) -> Optional[str]:
+    # numero in formato E.164 (+390612345678) o None se non plausibile
+    raw = raw.strip()
+    digits = re.sub(r"\D", "", raw)
+    if raw.startswith("+") or raw.startswith("00"):
+        intl = digits if raw.startswith("+") else digits[2:]
+        # paese noto: il numero nazionale non può superare la sua lunghezza massima
+        for code, keep_trunk, _, max_len in _PHONE_REGIONS.values():
+            if intl.startswith(code) and len(intl) - len(code) > max_len - (0 if keep_trunk else 1):
+                return None
+    else:
+        code, keep_trunk, leading, max_len = _PHONE_REGIONS.get((region or PHONE_DEFAULT_REGION).upper(), _PHONE_REGIONS["IT"])
+        if not 6 <= len(digits) <= max_len or (leading and digits[0] not in leading):
+            return None
+        national = digits if keep_trunk else digits.lstrip("0")
+        intl = code + national
+    if intl.startswith("0") or not 8 <= len(intl) <= 15:
+        return None
+    return "+" + intl
+
+def _collect_phones(text: str, tel: Iterable[str] = (), region: Optional[str] = None) -> List[str]:
+    text = text[:FALLBACK_MAX_TEXT]
+    out = set()
+    for m in _PHONE_RE.finditer(text):
+        g = m.group(0)
+        if len(g) < 6:  # meno di 6 cifre: orari, prezzi, numeri civici
+            continue
+        # P.IVA, codice fiscale, REA, CAP, date: sequenze di cifre che non sono telefoni
+        if _DATE_RE.match(g) or _PHONE_CONTEXT_RE.search(text, max(0, m.start() - 12), m.start()):
+            continue
+        # numeri accostati ("06 12345678 2 persone"): un gruppo finale di una sola
+        # cifra non fa parte del numero, e se è ancora troppo lungo si tolgono i gruppi finali
+        g = _PHONE_TAIL_RE.sub("", g)
+        p = normalize_phone(g, region)
+        while p is None and _PHONE_SEP_RE.search(g):
+            g = _PHONE_SEP_RE.split(g[::-1], 1)[1][::-1]
+            p = normalize_phone(g, region) if len(g) >= 6 else None
+        if p:
+            out.add(p)
+    for href in tel:
+        p = normalize_phone(unquote(href.split(":", 1)[-1]), region)
+        if p:
+            out.add(p)
+    return sorted(out)
+
+_UTF8_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+def _visible_text(html_doc: str) -> Dict[str, Any]:
+    # testo visibile + link tel:/mailto:, senza script/style/JSON inline (su TA sono MB)
+    out: Dict[str, Any] = {"title": None, "text": "", "tel": [], "mailto": []}
+    try:
+        # documento intero (uno script in <head> può superare i MB) e in bytes:
+        # con una stringa lxml rifiuta le pagine che iniziano con <?xml encoding=...?>
+        doc = lxml.html.document_fromstring(html_doc.encode("utf-8", "replace"), parser=_UTF8_PARSER)
+    except (etree.ParserError, ValueError):
+        return out
+    t = doc.find(".//title")
+    out["title"] = t.text_content() if t is not None else None
+    for a in doc.iter("a"):
+        href = (a.get("href") or "").strip()
+        scheme = href[:7].lower()
+        if scheme.startswith("tel:"):
+            out["tel"].append(href)
+        elif scheme == "mailto:":
+            out["mailto"].append(href)
+    etree.strip_elements(doc, *_INVISIBLE_TAGS, etree.Comment, with_tail=False)
+    body = doc.find("body")
+    chunks, size = [], 0
+    for chunk in (body if body is not None else doc).itertext():
+        chunks.append(chunk)
+        size += len(chunk) + 1
+        if size >= FALLBACK_MAX_TEXT:
+            break
+    out["text"] = "\n".join(chunks)[:FALLBACK_MAX_TEXT]
+    return out
+
+def _extract_structured(html_doc: str, url: str, syntaxes: Iterable[str] = ("json-ld", "microdata", "opengraph", "rdfa")) -> Dict[str, Any]:
+    import extruct  # pesante (rdflib, mf2py...): solo se un adapter chiede altre sintassi
     base = get_base_url(html_doc, url)
-    return extruct.extract(html_doc, base_url=base, syntaxes=["json-ld", "microdata", "opengraph", "rdfa"])
+    return extruct.extract(html_doc, base_url=base, syntaxes=list(syntaxes))
+
+def _extract_jsonld(html_doc: str) -> List[Any]:
+    # equivalente a extruct json-ld (liste appiattite, blocchi vuoti scartati) ma senza lxml
+    out: List[Any] = []
+    for m in _JSONLD_RE.finditer(html_doc):
+        raw = m.group(1)
+        try:
+            data = json.loads(raw, strict=False)
+        except ValueError:
+            try:
+                data = json.loads(_COMMENTLINE_RE.sub("", raw).replace("<![CDATA[", "").replace("]]>", ""), strict=False)
+            except ValueError:
+                continue
+        if isinstance(data, list):
+            out.extend(x for x in data if x)
+        elif isinstance(data, dict) and data:
+            out.append(data)
+    return out
+
+def _microdata_to_jsonld(md: Any) -> Any:
+    # {"type": ".../Restaurant", "properties": {...}} -> {"@type": "Restaurant", ...}
+    if isinstance(md, list):
+        return [_microdata_to_jsonld(x) for x in md]
+    if not isinstance(md, dict) or "properties" not in md:
+        return md
+    t = md.get("type")
+    types = [x.rstrip("/").rsplit("/", 1)[-1] for x in (t if isinstance(t, list) else [t]) if isinstance(x, str)]
+    out = {k: _microdata_to_jsonld(v) for k, v in (md.get("properties") or {}).items()}
+    out["@type"] = types[0] if len(types) == 1 else types
+    return out
 
 def _type_matches(t: Any, allowed: set[str]) -> bool:
     if isinstance(t, str):
@@ -81,7 +224,7 @@ def _entity_from_jsonld_item(item: dict, source_url: str) -> dict:
         if tel:
             phones = [tel]
     ent = {
-        "entity_type": "Restaurant" if _type_matches(item.get("@type"), {"Restaurant"}) else _clean_text(item.get("@type") if isinstance(item.get("@type"), str) else None),
+        "entity_type": "Restaurant" if _type_matches(item.get("@type"), _RESTAURANT) else _clean_text(item.get("@type") if isinstance(item.get("@type"), str) else None),
         "name": name,
         **addr,
         "phones": phones,
@@ -117,13 +260,13 @@ def _from_itemlist(block: dict, source_url: str) -> List[dict]:
             items.append(_entity_from_jsonld_item(item, source_url))
     return items
 
-def parse_entity(html_doc: str, url: str) -> Dict[str, List[dict]]:
-    soup = BeautifulSoup(html_doc, "lxml")
-    data = _extract_structured(html_doc, url)
+def parse_entity(html_doc: str, url: str, syntaxes: Optional[Iterable[str]] = None) -> Dict[str, List[dict]]:
+    syntaxes = tuple(syntaxes or DEFAULT_SYNTAXES)
+    jsonld = _extract_jsonld(html_doc) if "json-ld" in syntaxes else []
     results: List[dict] = []
 
     # 1) Se c'è un ItemList con ristoranti, estrai direttamente le schede (solo ristoranti).
-    for block in data.get("json-ld", []):
+    for block in jsonld:
         if isinstance(block, dict) and block.get("@type") == "ItemList":
             items = _from_itemlist(block, url)
             if items:
@@ -131,21 +274,32 @@ def parse_entity(html_doc: str, url: str) -> Dict[str, List[dict]]:
 
     # 2) Se non abbiamo trovato nulla via ItemList, cerca blocchi singoli Restaurant/LocalBusiness/Hotel ecc.
     if not results:
-        for block in data.get("json-ld", []):
+        for block in jsonld:
             if not isinstance(block, dict):
                 continue
             if _type_matches(block.get("@type"), ALLOWED_TYPES):
                 results.append(_entity_from_jsonld_item(block, url))
 
+    # Le altre sintassi (extruct) solo se servono davvero e se l'adapter le chiede.
+    extra = [x for x in syntaxes if x != "json-ld"]
+    data: Dict[str, Any] = _extract_structured(html_doc, url, extra) if extra and not results else {}
+    if not results:
+        for block in _microdata_to_jsonld(data.get("microdata", [])):
+            if isinstance(block, dict) and _type_matches(block.get("@type"), ALLOWED_TYPES):
+                results.append(_entity_from_jsonld_item(block, url))
+
     # 3) Fallback minimale: estrai email/phone visibili nella pagina – ma solo se NON abbiamo nulla.
     if not results:
-        page_text = soup.get_text("\n", strip=True)
-        phones = _collect_phones(page_text)
-        emails = _collect_emails(html_doc)
+        page = _visible_text(html_doc)
+        phones = _collect_phones(page["text"], page["tel"])
+        emails = _collect_emails(page["text"], page["mailto"])
         if phones or emails:
+            og = next((b for b in data.get("opengraph", []) if isinstance(b, dict)), {})
+            og_title = dict(x for x in og.get("properties", []) if len(x) == 2).get("og:title")
+            title = page["title"] or og_title
             results.append({
                 "entity_type": None,
-                "name": _clean_text(soup.title.string) if soup.title and soup.title.string else None,
+                "name": _clean_text(title) if title else None,
                 "address": None, "locality": None, "region": None, "postal_code": None, "country": None,
                 "phones": phones, "emails": emails,
                 "website": url, "socials": {}, "geo": None, "categories": [],
@@ -0,0 +1,198 @@
+from __future__ import annotations
+import asyncio, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from w3lib.url import canonicalize_url
+from .utils import env_int, env_float
+
+# Cache of finished scrapes (items, errors) so that /download.* right after
+# /scrape does not fetch the same page again.
+
+Result = Tuple[List[dict], List[str]]
+
+
+def cache_key(url: str, use_browser: bool, respect_robots: bool, crawl: bool = False,
+              max_pages: Optional[int] = None) -> str:
+    try:
+        norm = canonicalize_url(url)
+    except Exception:
+        norm = url
+    return f"{norm}|b={int(use_browser)}|r={int(respect_robots)}|c={int(crawl)}|p={max_pages or 0}"
+
+
+class MemoryBackend:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: "OrderedDict[str, Tuple[float, int, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        ent = self._data.get(key)
+        if ent is None:
+            return None
+        if ent[0] <= time.time():
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return ent[2]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.delete(key)
+        if len(value) > self.max_bytes:
+            return
+        self._data[key] = (time.time() + ttl, len(value), value)
+        self.size += len(value)
+        while self.size > self.max_bytes and self._data:
+            _, (_, n, _) = self._data.popitem(last=False)
+            self.size -= n
+
+    def delete(self, key: str) -> None:
+        ent = self._data.pop(key, None)
+        if ent is not None:
+            self.size -= ent[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "entries": len(self._data), "bytes": self.size, "max_bytes": self.max_bytes}
+
+
+class SqliteBackend:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                         "expires REAL NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                             (key, value, len(value), now + ttl, now))
+            self._db.execute("DELETE FROM results WHERE expires <= ?", (now,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                # drop least recently used rows until we are back under the budget
+                excess = total - self.max_bytes
+                for k, n in self._db.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+                    if excess <= 0:
+                        break
+                    self._db.execute("DELETE FROM results WHERE key = ?", (k,))
+                    excess -= n
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM results")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            n, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"backend": "sqlite", "path": self.path, "entries": n, "bytes": size, "max_bytes": self.max_bytes}
+
+
+class ResultCache:
+    def __init__(self, backend, ttl: Optional[float] = None):
+        self.backend = backend
+        self.ttl = ttl or env_float("RESULT_CACHE_TTL", 600.0)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # SQLite does disk I/O (and eviction on set): keep it off the event loop
+        self._blocking = not isinstance(backend, MemoryBackend)
+
+    async def _backend(self, method: Callable, *args):
+        if self._blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def _compute(self, key: str, fn: Callable[[], Awaitable[Result]]) -> Result:
+        try:
+            items, errors = await fn()
+            if items:
+                # only successful scrapes are cached: errors are often transient
+                await self._backend(self.backend.set, key, json.dumps([items, errors], ensure_ascii=False).encode("utf-8"), self.ttl)
+            return items, errors
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_compute(self, key: str, fn: Callable[[], Awaitable[Result]]) -> Result:
+        raw = await self._backend(self.backend.get, key)
+        if raw is not None:
+            self.hits += 1
+            items, errors = json.loads(raw)
+            return items, errors
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._compute(key, fn))
+        else:
+            self.coalesced += 1
+        items, errors = await asyncio.shield(task)
+        # each caller gets its own lists
+        return [dict(i) for i in items], list(errors)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        if key is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            **self.backend.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.coalesced) / total, 4) if total else 0.0,
+            "inflight": len(self._inflight),
+            "ttl": self.ttl,
+        }
+
+
+_cache: Optional[ResultCache] = None
+
+def get_result_cache() -> Optional[ResultCache]:
+    # RESULT_CACHE_BACKEND: memory (default) | sqlite | off
+    global _cache
+    if _cache is None:
+        kind = (os.getenv("RESULT_CACHE_BACKEND") or "memory").lower()
+        if kind in ("off", "none", "0"):
+            return None
+        max_bytes = env_int("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        if kind == "sqlite":
+            backend = SqliteBackend(os.getenv("RESULT_CACHE_PATH") or "result_cache.sqlite3", max_bytes)
+        else:
+            backend = MemoryBackend(max_bytes)
+        _cache = ResultCache(backend)
+    return _cache
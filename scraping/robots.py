@@ -0,0 +1,123 @@
+from __future__ import annotations
+import asyncio, time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from robotexclusionrulesparser import RobotExclusionRulesParser
+from .utils import randomized_headers, env_int, env_float
+from .http_client import get_client
+
+# Per-origin cache of parsed robots.txt: TTL from Cache-Control/Expires,
+# bounded LRU, negative caching and single-flight fetches.
+
+def _ttl_from_headers(headers, default: float) -> float:
+    cc = (headers.get("cache-control") or "").lower()
+    if "no-store" in cc or "no-cache" in cc:
+        return 0.0
+    for part in cc.split(","):
+        k, _, v = part.strip().partition("=")
+        if k in ("s-maxage", "max-age"):
+            try:
+                return float(v.strip('"'))
+            except ValueError:
+                pass
+    exp = headers.get("expires")
+    if exp:
+        try:
+            return parsedate_to_datetime(exp).timestamp() - time.time()
+        except Exception:
+            pass
+    return default
+
+
+class _Entry:
+    __slots__ = ("parser", "expires", "negative")
+
+    def __init__(self, parser: Optional[RobotExclusionRulesParser], expires: float, negative: bool):
+        self.parser = parser
+        self.expires = expires
+        self.negative = negative
+
+
+class RobotsCache:
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 negative_ttl: Optional[float] = None, min_ttl: float = 60.0, max_ttl: float = 86400.0):
+        self.max_entries = max_entries or env_int("ROBOTS_CACHE_SIZE", 512)
+        self.ttl = ttl or env_float("ROBOTS_CACHE_TTL", 3600.0)
+        self.negative_ttl = negative_ttl or env_float("ROBOTS_NEGATIVE_TTL", 300.0)
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _fetch(self, base: str) -> Tuple[Optional[RobotExclusionRulesParser], float, bool]:
+        try:
+            r = await get_client().get(base + "/robots.txt", headers=randomized_headers(), timeout=10)
+        except Exception:
+            # timeout / connection error: allow, but retry sooner
+            return None, self.negative_ttl, True
+        if r.status_code == 200 and r.text:
+            rp = RobotExclusionRulesParser()
+            rp.parse(r.text)
+            ttl = _ttl_from_headers(r.headers, self.ttl)
+            return rp, min(self.max_ttl, max(self.min_ttl, ttl)), False
+        if 400 <= r.status_code < 500:
+            # 404/410 & co.: no rules, same lifetime as a real file
+            return None, self.ttl, True
+        return None, self.negative_ttl, True
+
+    async def _load(self, key: str) -> Optional[RobotExclusionRulesParser]:
+        try:
+            rp, ttl, negative = await self._fetch(key)
+            self._entries[key] = _Entry(rp, time.monotonic() + ttl, negative)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return rp
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get(self, base: str) -> Optional[RobotExclusionRulesParser]:
+        key = base.rstrip("/").lower()
+        ent = self._entries.get(key)
+        if ent is not None:
+            if ent.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return ent.parser
+            del self._entries[key]
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._load(key))
+        # shield: a cancelled caller must not cancel the fetch other callers wait on
+        return await asyncio.shield(task)
+
+    def invalidate(self, base: Optional[str] = None) -> None:
+        if base is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(base.rstrip("/").lower(), None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "negative_entries": sum(1 for e in self._entries.values() if e.negative),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "max_entries": self.max_entries,
+        }
+
+
+_cache: Optional[RobotsCache] = None
+
+def get_robots_cache() -> RobotsCache:
+    global _cache
+    if _cache is None:
+        _cache = RobotsCache()
+    return _cache
@@ -1,45 +1,209 @@
-from typing import List, Tuple
-from urllib.parse import urlsplit
-from .fetchers import HttpFetcher, BrowserFetcher
-from .parsers import parse_entity
-from .site_adapters import apply_adapters
-from .utils import fetch_robots_txt, allowed_by_robots
+import asyncio
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit, urldefrag
+from .fetchers import HttpFetcher
+from .browser_pool import get_browser_pool
+from .parse_executor import get_parse_executor
+from .site_adapters import discover_pages
+from .result_cache import get_result_cache, cache_key
+from .store import get_entity_store, page_key
+from .http_cache import get_http_cache
+from .strategy import get_strategy_tracker
+from .metrics import stage, PAGES, ITEMS_PER_PAGE, BROWSER_FALLBACKS
+from .utils import fetch_robots_txt, allowed_by_robots, env_int
 import os
 
-async def scrape_url(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True) -> Tuple[List[dict], List[str]]:
+_BLOCKED_STATUSES = (401, 403, 429, 500, 502, 503, 504)
+# una 200 senza item passa comunque dal browser (siti che renderizzano i dati in JS);
+# di default, come prima, il risultato vuoto dell'HTTP viene restituito così com'è
+_BROWSER_ON_EMPTY = os.getenv("BROWSER_ON_EMPTY", "").lower() in ("1", "true", "yes")
+
+async def _scrape_page(url: str, use_browser: bool, max_wait_ms: int, respect_robots: bool) -> Tuple[List[dict], List[str], str]:
+    # come scrape_url, ma restituisce anche l'HTML (serve al crawler per trovare le pagine successive)
     errors: List[str] = []
-    url = str(url)  # garanzia
+    cache = get_http_cache()
+    offline = cache is not None and cache.offline  # replay: niente rete, né robots né browser
 
-    if respect_robots:
+    if respect_robots and not offline:
         try:
             parts = urlsplit(url)
             base_url = f"{parts.scheme}://{parts.netloc}"
-            rp = await fetch_robots_txt(base_url)
+            with stage("robots"):
+                rp = await fetch_robots_txt(base_url)
             if not allowed_by_robots(rp, url):
-                return [], [f"Blocked by robots.txt: {url}"]
+                return [], [f"Blocked by robots.txt: {url}"], ""
         except Exception as e:
             errors.append(f"robots.txt check failed: {e}")
 
-    http_fetcher = HttpFetcher(max_retries=3, max_wait_ms=max_wait_ms)
+    browser_available = use_browser and not offline and not os.getenv("DISABLE_BROWSER")
+    tracker = get_strategy_tracker()
+    # host noti per bloccare l'HTTP (o per avere i dati solo nel browser) vanno diretti al browser
+    try_http, retries = tracker.route(url, browser_available) if not offline else (True, 3)
+    http_outcome: Optional[str] = None
+    browser_found = False
     try:
-        status, html = await http_fetcher.fetch(url)
-        if status == 200 and html:
-            html = apply_adapters(url, html)
-            parsed = parse_entity(html, url)
-            return parsed["items"], errors
-    except Exception as e:
-        errors.append(f"http fetch error: {e}")
-
-    if use_browser and not os.getenv("DISABLE_BROWSER"):
-        bf = BrowserFetcher(max_wait_ms=max_wait_ms)
-        try:
-            status, html = bf.fetch_sync(url)
-            html = apply_adapters(url, html)
-            parsed = parse_entity(html, url)
-            return parsed["items"], errors
-        except Exception as e:
-            errors.append(f"browser fetch error: {e}")
-        finally:
-            bf.close()
+        if try_http:
+            status, html = 0, ""
+            try:
+                http_fetcher = HttpFetcher(max_retries=retries)
+                with stage("http_fetch"):
+                    status, html = await http_fetcher.fetch(url)
+            except Exception as e:
+                errors.append(f"http fetch error: {e}")
+                http_outcome = "blocked"  # errore di rete dopo i retry
+            if status in _BLOCKED_STATUSES:
+                http_outcome = "blocked"
+            # 404 & co. dicono qualcosa sulla pagina, non sull'host: non registrati
+            if status == 200 and html:
+                try:
+                    items = await get_parse_executor().parse(url, html)
+                    PAGES.inc(1, "http")
+                    ITEMS_PER_PAGE.observe(len(items))
+                    # un errore del parser non è colpa dell'host: in quel caso nessun esito
+                    http_outcome = "ok" if items else "empty"
+                    if items or not browser_available or not _BROWSER_ON_EMPTY:
+                        return items, errors, html
+                except Exception as e:
+                    errors.append(f"http parse error: {e}")
+
+        if browser_available:
+            if try_http:
+                BROWSER_FALLBACKS.inc()
+            try:
+                with stage("browser_fetch"):
+                    status, html = await get_browser_pool().fetch(url, max_wait_ms=max_wait_ms)
+                items = await get_parse_executor().parse(url, html)
+                PAGES.inc(1, "browser")
+                ITEMS_PER_PAGE.observe(len(items))
+                browser_found = bool(items)
+                tracker.record_browser(url, browser_found)
+                return items, errors, html
+            except Exception as e:
+                errors.append(f"browser fetch error: {e}")
+
+        return [], errors, ""
+    finally:
+        # registrato dopo il browser: una pagina HTTP vuota conta come fallimento solo se
+        # il browser, su questa stessa pagina, trova dati
+        if http_outcome is not None and not offline:
+            tracker.record_http(url, http_outcome, browser_found)
+            await tracker.maybe_flush()
+
+
+async def scrape_url(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                     crawl: bool = False, max_pages: Optional[int] = None, use_cache: bool = True) -> Tuple[List[dict], List[str]]:
+    url = str(url)  # garanzia
+
+    # replay offline: serve a rieseguire i parser sulle pagine salvate, quindi
+    # niente risultati già parsati (né store né result cache)
+    http_cache = get_http_cache()
+    replay = http_cache is not None and http_cache.offline
+
+    async def run() -> Tuple[List[dict], List[str]]:
+        store = None if replay else get_entity_store()
+        key = page_key(url, crawl, max_pages, use_browser)
+        if store is not None:
+            # pagina già scaricata di recente: niente fetch, si legge dallo store
+            fresh = await asyncio.to_thread(store.fresh_items, key)
+            if fresh is not None:
+                return fresh, []
+        if crawl:
+            items, errors = await crawl_url(url, use_browser, max_wait_ms, respect_robots, max_pages=max_pages)
+        else:
+            items, errors, _ = await _scrape_page(url, use_browser, max_wait_ms, respect_robots)
+        if store is not None and items:
+            try:
+                await asyncio.to_thread(store.save, key, items, url)
+            except Exception as e:
+                errors.append(f"entity store error: {e}")
+        return items, errors
+
+    cache = get_result_cache() if use_cache and not replay else None
+    if cache is None:
+        return await run()
+    return await cache.get_or_compute(cache_key(url, use_browser, respect_robots, crawl, max_pages), run)
+
+
+def _item_key(item: dict) -> tuple:
+    return (item.get("name"), item.get("address"), item.get("postal_code"), item.get("website"))
+
+
+async def crawl_url(url: str, use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                    max_pages: Optional[int] = None, concurrency: Optional[int] = None) -> Tuple[List[dict], List[str]]:
+    # segue la paginazione proposta dagli adapter (es. TripAdvisor oa30/oa60) e unisce gli item
+    max_pages = max(1, max_pages or env_int("CRAWL_MAX_PAGES", 50))
+    concurrency = max(1, concurrency or env_int("CRAWL_CONCURRENCY", 4))
+    start = urldefrag(str(url))[0]
+    order: List[str] = [start]
+    seen = {start}
+    results: Dict[str, List[dict]] = {}
+    errors: List[str] = []
+    queue: "asyncio.Queue[str]" = asyncio.Queue()
+    queue.put_nowait(start)
+
+    async def worker():
+        while True:
+            page = await queue.get()
+            try:
+                items, errs, html = await _scrape_page(page, use_browser, max_wait_ms, respect_robots)
+                results[page] = [{**i, "source_url": page} for i in items]
+                errors.extend(errs if page == start else [f"{page}: {e}" for e in errs])
+                # la frontiera è limitata: non si accodano più di max_pages URL in totale
+                for nxt in (discover_pages(page, html) if items else []):
+                    nxt = urldefrag(nxt)[0]
+                    if nxt not in seen and len(seen) < max_pages:
+                        seen.add(nxt)
+                        order.append(nxt)
+                        queue.put_nowait(nxt)
+            except Exception as e:
+                errors.append(f"crawl error on {page}: {e}")
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        await queue.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    merged: List[dict] = []
+    keys = set()
+    for page in order:
+        for item in results.get(page, []):
+            k = _item_key(item)
+            if k not in keys:
+                keys.add(k)
+                merged.append(item)
+    return merged, errors
+
+
+async def scrape_urls(urls: Iterable[str], use_browser: bool = True, max_wait_ms: int = 2000, respect_robots: bool = True,
+                      concurrency: Optional[int] = None, per_host: Optional[int] = None,
+                      crawl: bool = False, max_pages: Optional[int] = None) -> AsyncIterator[Tuple[str, List[dict], List[str]]]:
+    # stessi argomenti di scrape_url, ma per una lista: yield (url, items, errors) appena ogni URL termina
+    unique = list(dict.fromkeys(s for s in (str(u).strip() for u in urls) if s))
+    global_sem = asyncio.Semaphore(concurrency or env_int("BATCH_CONCURRENCY", 8))
+    per_host = per_host or env_int("BATCH_PER_HOST", 2)
+    host_sems: Dict[str, asyncio.Semaphore] = {}
+
+    async def one(u: str) -> Tuple[str, List[dict], List[str]]:
+        host = urlsplit(u).netloc.lower()
+        host_sem = host_sems.setdefault(host, asyncio.Semaphore(per_host))
+        # prima lo slot dell'host, poi quello globale: un host lento non occupa slot globali in attesa
+        async with host_sem, global_sem:
+            try:
+                items, errors = await scrape_url(u, use_browser, max_wait_ms, respect_robots, crawl, max_pages)
+            except Exception as e:
+                items, errors = [], [f"scrape error: {e}"]
+        return u, items, errors
+
+    tasks = [asyncio.ensure_future(one(u)) for u in unique]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
 
-    return [], errors
@@ -1,12 +1,16 @@
 from __future__ import annotations
-from bs4 import BeautifulSoup
+import re
 from urllib.parse import urlparse, urljoin
-from typing import List
+from typing import List, Optional, Tuple
 
 # Adapter pattern: add site-specific tweaks when needed.
 
 class BaseAdapter:
     domains: List[str] = []
+    # Structured-data syntaxes parse_entity should extract (None = parser default)
+    syntaxes: Optional[Tuple[str, ...]] = None
+    # CSS selector whose presence means the browser page holds the data (None = JSON-LD check)
+    ready_selector: Optional[str] = None
 
     def applies(self, url: str) -> bool:
         host = urlparse(url).netloc.lower()
@@ -16,14 +20,36 @@ class BaseAdapter:
         # Optionally clean/expand HTML before generic parsing
         return html
 
+    def discover_next_pages(self, url: str, html: str) -> List[str]:
+        # Optionally return further listing pages to crawl from this one
+        return []
+
+_TA_LIST_PATH_RE = re.compile(r"^/Restaurants-g(\d+)-(?:oa(\d+)-)?(.+\.html)$")
+_TA_PAGE_SIZE = 30
+
 class TripAdvisorAdapter(BaseAdapter):
     domains = ["tripadvisor."]
+    # everything we consume on TA is JSON-LD
+    syntaxes = ("json-ld",)
 
     def pre_process(self, html: str) -> str:
         # TA often hides emails/phones; generic extraction may still catch visible info.
         # Here we could add future heuristics if needed.
         return html
 
+    def discover_next_pages(self, url: str, html: str) -> List[str]:
+        # City listings paginate as /Restaurants-g<geo>-oa30-<City>.html, -oa60-, ...
+        m = _TA_LIST_PATH_RE.match(urlparse(url).path)
+        if not m:
+            return []
+        geo, offset, tail = m.group(1), int(m.group(2) or 0), m.group(3)
+        link_re = re.compile(r"""href=["'](/Restaurants-g%s-oa\d+-[^"'#?]+\.html)""" % geo)
+        out = list(dict.fromkeys(urljoin(url, h) for h in link_re.findall(html)))
+        if not out and '"ItemList"' in html:
+            # no pagination links rendered: guess the next offset while the page still has a list
+            out.append(urljoin(url, f"/Restaurants-g{geo}-oa{offset + _TA_PAGE_SIZE}-{tail}"))
+        return out
+
 ADAPTERS = [TripAdvisorAdapter()]
 
 
@@ -32,3 +58,25 @@ def apply_adapters(url: str, html: str) -> str:
         if a.applies(url):
             return a.pre_process(html)
     return html
+
+
+def discover_pages(url: str, html: str) -> List[str]:
+    for a in ADAPTERS:
+        if a.applies(url):
+            return a.discover_next_pages(url, html)
+    return []
+
+
+def adapter_syntaxes(url: str) -> Optional[Tuple[str, ...]]:
+    for a in ADAPTERS:
+        if a.applies(url):
+            return a.syntaxes
+    return None
+
+
+def adapter_ready_selector(url: str) -> Optional[str]:
+    for a in ADAPTERS:
+        if a.applies(url):
+            return a.ready_selector
+    return None
+
@@ -0,0 +1,215 @@
+from __future__ import annotations
+import hashlib, json, os, re, sqlite3, threading, time, unicodedata
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+from urllib.parse import urlsplit
+from w3lib.url import canonicalize_url
+from .utils import env_float
+
+# Persistent SQLite store of scraped entities: deduplicated by a stable
+# identity, upserted on re-scrape, queryable for exports.
+
+_JSON_FIELDS = ("phones", "emails", "socials", "geo", "categories")
+_FIELDS = ("source_url", "entity_type", "name", "address", "locality", "region", "postal_code", "country",
+           "phones", "emails", "website", "socials", "geo", "categories", "rating", "data_quality", "scraped_at")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    identity TEXT PRIMARY KEY,
+    source_url TEXT,
+    entity_type TEXT,
+    name TEXT,
+    address TEXT,
+    locality TEXT COLLATE NOCASE,
+    region TEXT COLLATE NOCASE,
+    postal_code TEXT,
+    country TEXT,
+    phones TEXT,
+    emails TEXT,
+    website TEXT,
+    socials TEXT,
+    geo TEXT,
+    categories TEXT,
+    rating REAL,
+    data_quality REAL,
+    scraped_at TEXT,
+    first_seen TEXT
+);
+CREATE INDEX IF NOT EXISTS entities_locality ON entities(locality, rating);
+CREATE INDEX IF NOT EXISTS entities_region ON entities(region, rating);
+CREATE INDEX IF NOT EXISTS entities_rating ON entities(rating);
+CREATE TABLE IF NOT EXISTS pages (
+    page_key TEXT PRIMARY KEY,
+    scraped_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS page_entities (
+    page_key TEXT NOT NULL,
+    identity TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (page_key, identity)
+);
+"""
+
+def _norm(s: Optional[str]) -> str:
+    if not s:
+        return ""
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(c for c in s if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", s.casefold()).strip()
+
+def _norm_site(url: Optional[str]) -> str:
+    if not url:
+        return ""
+    p = urlsplit(url)
+    host = p.netloc.lower()
+    return (host[4:] if host.startswith("www.") else host) + p.path.rstrip("/")
+
+def entity_identity(item: dict) -> str:
+    # nome normalizzato + sito della scheda, altrimenti telefono, altrimenti CAP:
+    # catene con lo stesso nome nello stesso CAP restano entità distinte
+    name = _norm(item.get("name"))
+    phones = item.get("phones") or []
+    phone = re.sub(r"\D", "", phones[0]) if phones else ""
+    site = _norm_site(item.get("website"))
+    if site and site == _norm_site(item.get("source_url")):
+        site = ""  # sito = pagina di listing: uguale per tutti gli item, non distingue
+    disc = site or phone or _norm(item.get("postal_code"))
+    if not name and not disc:
+        disc = _norm_site(item.get("source_url"))
+    return hashlib.sha1(f"{name}|{disc}".encode("utf-8")).hexdigest()
+
+def page_key(url: str, crawl: bool = False, max_pages: Optional[int] = None, use_browser: bool = True) -> str:
+    # le opzioni che cambiano il risultato fanno parte della chiave (come in cache_key):
+    # un crawl limitato a 1 pagina non deve servire una richiesta da 50
+    try:
+        key = canonicalize_url(url)
+    except Exception:
+        key = url
+    key += "" if use_browser else "#nobrowser"
+    return key + (f"#crawl={max_pages or 0}" if crawl else "")
+
+def _iso(v) -> str:
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return v or datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+
+
+class EntityStore:
+    def __init__(self, path: str, freshness: Optional[float] = None):
+        self.path = path
+        self.freshness = freshness if freshness is not None else env_float("ENTITY_STORE_FRESHNESS", 86400.0)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def _row(self, item: dict, fallback_url: str) -> tuple:
+        vals = []
+        for f in _FIELDS:
+            v = item.get(f)
+            if f == "source_url":
+                v = v or fallback_url
+            elif f == "scraped_at":
+                v = _iso(v)
+            elif f in _JSON_FIELDS:
+                v = json.dumps(v, ensure_ascii=False) if v is not None else None
+            vals.append(v)
+        return (entity_identity({**item, "source_url": item.get("source_url") or fallback_url}), *vals, vals[-1])
+
+    def save(self, key: str, items: Iterable[dict], url: str) -> int:
+        rows = [self._row(i, url) for i in items]
+        cols = ("identity",) + _FIELDS + ("first_seen",)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in _FIELDS)
+        sql = (f"INSERT INTO entities ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+               f"ON CONFLICT(identity) DO UPDATE SET {updates}")
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(sql, rows)
+                self._db.execute("DELETE FROM page_entities WHERE page_key = ?", (key,))
+                self._db.executemany("INSERT OR IGNORE INTO page_entities VALUES (?, ?, ?)",
+                                     [(key, r[0], n) for n, r in enumerate(rows)])
+                self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?)", (key, time.time()))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def _decode(self, cur: sqlite3.Cursor) -> List[dict]:
+        names = [d[0] for d in cur.description]
+        out = []
+        for row in cur.fetchall():
+            d = dict(zip(names, row))
+            for f in _JSON_FIELDS:
+                if d.get(f) is not None:
+                    d[f] = json.loads(d[f])
+            out.append(d)
+        return out
+
+    def fresh_items(self, key: str) -> Optional[List[dict]]:
+        # items della pagina se scaricata entro la finestra di freschezza, altrimenti None
+        if self.freshness <= 0:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT scraped_at FROM pages WHERE page_key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[0] > self.freshness:
+                return None
+            cur = self._db.execute(f"SELECT {', '.join('e.' + f for f in _FIELDS)} FROM page_entities p "
+                                   "JOIN entities e ON e.identity = p.identity "
+                                   "WHERE p.page_key = ? ORDER BY p.position", (key,))
+            items = self._decode(cur)
+        return items or None
+
+    def query(self, locality: Optional[str] = None, region: Optional[str] = None,
+              min_rating: Optional[float] = None, max_rating: Optional[float] = None,
+              limit: Optional[int] = None, offset: int = 0) -> List[dict]:
+        where, args = [], []
+        if locality:
+            where.append("locality = ?"); args.append(locality)
+        if region:
+            where.append("region = ?"); args.append(region)
+        if min_rating is not None:
+            where.append("rating >= ?"); args.append(min_rating)
+        if max_rating is not None:
+            where.append("rating <= ?"); args.append(max_rating)
+        sql = f"SELECT {', '.join(_FIELDS)} FROM entities"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY rating DESC, name LIMIT ? OFFSET ?"
+        args += [limit if limit is not None else -1, offset]
+        with self._lock:
+            return self._decode(self._db.execute(sql, args))
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = self._db.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+            p = self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        return {"path": self.path, "entities": n, "pages": p, "freshness": self.freshness}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_store: Optional[EntityStore] = None
+_store_lock = threading.Lock()
+
+def get_entity_store() -> Optional[EntityStore]:
+    # abilitato solo se ENTITY_STORE_PATH è impostato
+    global _store
+    path = os.getenv("ENTITY_STORE_PATH")
+    if not path:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = EntityStore(path)
+        return _store
+
+def close_entity_store() -> None:
+    global _store
+    with _store_lock:
+        store, _store = _store, None
+    if store is not None:
+        store.close()
@@ -0,0 +1,199 @@
+from __future__ import annotations
+import asyncio, os, sqlite3, threading, time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from .utils import env_int, env_float
+
+# Per-domain fetch strategy: remembers whether plain HTTP works for a host.
+# A circuit breaker on the HTTP path sends hosts that keep blocking us (or
+# that only render data in the browser) straight to the browser, probing HTTP
+# again once per cooldown (half-open). Stats survive restarts when
+# STRATEGY_STATS_PATH points to a SQLite file.
+
+_FIELDS = ("http_ok", "http_empty", "http_blocked", "browser_ok", "browser_empty",
+           "failures", "state", "opened_at", "open_for", "updated_at")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    host TEXT PRIMARY KEY,
+    http_ok INTEGER NOT NULL,
+    http_empty INTEGER NOT NULL,
+    http_blocked INTEGER NOT NULL,
+    browser_ok INTEGER NOT NULL,
+    browser_empty INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    opened_at REAL NOT NULL,
+    open_for REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+def _host(url: str) -> str:
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class DomainStats:
+    __slots__ = _FIELDS + ("probing_since",)
+
+    def __init__(self, http_ok=0, http_empty=0, http_blocked=0, browser_ok=0, browser_empty=0,
+                 failures=0, state="closed", opened_at=0.0, open_for=0.0, updated_at=0.0):
+        self.http_ok = http_ok
+        self.http_empty = http_empty
+        self.http_blocked = http_blocked
+        self.browser_ok = browser_ok
+        self.browser_empty = browser_empty
+        self.failures = failures  # consecutive HTTP failures
+        self.state = state  # closed | open | half_open
+        self.opened_at = opened_at
+        self.open_for = open_for
+        self.updated_at = updated_at
+        self.probing_since = 0.0
+
+    def as_dict(self) -> dict:
+        http = self.http_ok + self.http_empty + self.http_blocked
+        browser = self.browser_ok + self.browser_empty
+        return {
+            **{f: getattr(self, f) for f in _FIELDS},
+            "http_success_rate": round(self.http_ok / http, 4) if http else None,
+            "http_block_rate": round(self.http_blocked / http, 4) if http else None,
+            "browser_success_rate": round(self.browser_ok / browser, 4) if browser else None,
+        }
+
+
+class StrategyTracker:
+    def __init__(self, path: Optional[str] = None, failure_threshold: Optional[int] = None,
+                 open_seconds: Optional[float] = None, max_open_seconds: Optional[float] = None,
+                 http_retries: int = 3, probe_timeout: float = 120.0, flush_interval: float = 10.0):
+        self.path = path
+        self.failure_threshold = max(1, failure_threshold or env_int("STRATEGY_FAILURE_THRESHOLD", 3))
+        self.open_seconds = open_seconds or env_float("STRATEGY_OPEN_SECONDS", 300.0)
+        self.max_open_seconds = max_open_seconds or env_float("STRATEGY_MAX_OPEN_SECONDS", 6 * 3600.0)
+        self.http_retries = http_retries
+        self.probe_timeout = probe_timeout
+        self.flush_interval = flush_interval
+        self._domains: Dict[str, DomainStats] = {}
+        self._dirty: set = set()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(_SCHEMA)
+            for row in self._db.execute(f"SELECT host, {', '.join(_FIELDS)} FROM domains"):
+                self._domains[row[0]] = DomainStats(*row[1:])
+
+    def _get(self, host: str) -> DomainStats:
+        d = self._domains.get(host)
+        if d is None:
+            d = self._domains[host] = DomainStats()
+        return d
+
+    def route(self, url: str, browser_available: bool) -> Tuple[bool, int]:
+        # (try HTTP first?, max HTTP attempts)
+        now = time.time()
+        with self._lock:
+            d = self._domains.get(_host(url))
+            if d is None or d.state == "closed":
+                return True, self.http_retries
+            if d.state == "open" and now - d.opened_at >= d.open_for:
+                d.state = "half_open"
+            if d.state == "half_open" and now - d.probing_since >= self.probe_timeout:
+                # one probe at a time, a single attempt without retries
+                d.probing_since = now
+                return True, 1
+            # circuit open: straight to the browser; without one, a single attempt
+            return not browser_available, 1
+
+    def record_http(self, url: str, outcome: str, browser_found: bool = False) -> None:
+        # outcome: ok (items) | empty (200 without items) | blocked (403/429/5xx, errors)
+        # browser_found: the browser got items from this same page
+        host = _host(url)
+        now = time.time()
+        with self._lock:
+            d = self._get(host)
+            d.probing_since = 0.0
+            if outcome == "ok":
+                d.http_ok += 1
+                d.failures = 0
+                d.state, d.open_for = "closed", 0.0
+            else:
+                if outcome == "empty":
+                    d.http_empty += 1
+                else:
+                    d.http_blocked += 1
+                # an empty page only counts against HTTP if the browser got data from it
+                if outcome == "blocked" or browser_found:
+                    d.failures += 1
+                    if d.state == "half_open" or (d.state == "closed" and d.failures >= self.failure_threshold):
+                        # failed probe: stay open twice as long (capped)
+                        d.open_for = min(self.max_open_seconds, d.open_for * 2 if d.open_for else self.open_seconds)
+                        d.state, d.opened_at = "open", now
+                elif d.state == "half_open":
+                    # the probe got through and nothing says the browser does better
+                    d.failures = 0
+                    d.state, d.open_for = "closed", 0.0
+            d.updated_at = now
+            self._dirty.add(host)
+
+    def record_browser(self, url: str, ok: bool) -> None:
+        host = _host(url)
+        with self._lock:
+            d = self._get(host)
+            if ok:
+                d.browser_ok += 1
+            else:
+                d.browser_empty += 1
+            d.updated_at = time.time()
+            self._dirty.add(host)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._db is None or not self._dirty:
+                self._dirty.clear()
+                return
+            rows = [(h, *(getattr(self._domains[h], f) for f in _FIELDS)) for h in self._dirty]
+            self._dirty.clear()
+            self._last_flush = time.monotonic()
+            self._db.executemany(f"INSERT OR REPLACE INTO domains VALUES ({', '.join('?' * (len(_FIELDS) + 1))})", rows)
+
+    async def maybe_flush(self) -> None:
+        if self._db is not None and self._dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+            await asyncio.to_thread(self.flush)
+
+    def stats(self) -> dict:
+        with self._lock:
+            states: Dict[str, int] = {}
+            for d in self._domains.values():
+                states[d.state] = states.get(d.state, 0) + 1
+            browser_first = {h: d.as_dict() for h, d in sorted(self._domains.items()) if d.state != "closed"}
+        return {"path": self.path, "domains": len(self._domains), "states": states,
+                "browser_first": dict(list(browser_first.items())[:50])}
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_tracker: Optional[StrategyTracker] = None
+_tracker_lock = threading.Lock()
+
+def get_strategy_tracker() -> StrategyTracker:
+    # STRATEGY_STATS_PATH rende persistenti le statistiche tra i riavvii
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = StrategyTracker(os.getenv("STRATEGY_STATS_PATH") or None)
+        return _tracker
+
+def close_strategy_tracker() -> None:
+    global _tracker
+    with _tracker_lock:
+        tracker, _tracker = _tracker, None
+    if tracker is not None:
+        tracker.close()
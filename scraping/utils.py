@@ -1,24 +1,97 @@
 import os, random, time, asyncio
-from fake_useragent import UserAgent
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 from robotexclusionrulesparser import RobotExclusionRulesParser
-import httpx
 
-_UA = UserAgent()
+# User-Agent desktop recenti, in locale: nessun caricamento di dati all'avvio
+_USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36 Edg/124.0.0.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:124.0) Gecko/20100101 Firefox/124.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4.1 Safari/605.1.15",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14.4; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+)
 
 class RateLimiter:
-    def __init__(self, rate_per_sec: float = 1.0):
+    # token bucket (GCRA): each caller reserves its slot synchronously, so
+    # concurrent waiters on the same loop never get the same slot
+    def __init__(self, rate_per_sec: float = 1.0, burst: int = 1):
         self.min_interval = 1.0 / max(rate_per_sec, 1e-6)
-        self._last = 0.0
-    async def wait(self):
+        self.burst = max(1, burst)
+        self._tat = 0.0
+        self._blocked_until = 0.0
+
+    def reserve(self) -> float:
         now = time.monotonic()
-        delta = now - self._last
-        if delta < self.min_interval:
-            await asyncio.sleep(self.min_interval - delta)
-        self._last = time.monotonic()
+        tat = max(self._tat, now)
+        start = max(tat - (self.burst - 1) * self.min_interval, self._blocked_until, now)
+        self._tat = max(tat, start) + self.min_interval
+        return start - now
+
+    def block(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return self._tat <= now and self._blocked_until <= now
+
+    async def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class HostRateLimiter:
+    # one bucket per host, shared by every concurrent request
+    def __init__(self, rate_per_sec: float | None = None, burst: int | None = None, max_hosts: int = 1024):
+        self.rate_per_sec = rate_per_sec or env_float("RATE_LIMIT_PER_HOST", 1.0)
+        self.burst = burst or env_int("RATE_LIMIT_BURST", 1)
+        self.max_hosts = max_hosts
+        self._buckets: dict[str, RateLimiter] = {}
+
+    def _bucket(self, url: str) -> RateLimiter:
+        host = urlsplit(url).netloc.lower()
+        b = self._buckets.get(host)
+        if b is None:
+            if len(self._buckets) >= self.max_hosts:
+                self._buckets = {h: x for h, x in self._buckets.items() if not x.idle()}
+            b = self._buckets[host] = RateLimiter(self.rate_per_sec, self.burst)
+        return b
+
+    async def wait(self, url: str):
+        await self._bucket(url).wait()
+
+    def block(self, url: str, seconds: float) -> None:
+        self._bucket(url).block(seconds)
+
+_limiter: HostRateLimiter | None = None
+
+def get_rate_limiter() -> HostRateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = HostRateLimiter()
+    return _limiter
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
 
 def randomized_headers(extra: dict | None = None) -> dict:
     h = {
-        "User-Agent": _UA.random,
+        "User-Agent": random.choice(_USER_AGENTS),
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
         "Accept-Language": random.choice(["en-US,en;q=0.9", "it-IT,it;q=0.9,en;q=0.8"]),
         "Cache-Control": "no-cache",
@@ -28,6 +101,18 @@ def randomized_headers(extra: dict | None = None) -> dict:
     if extra: h.update(extra)
     return h
 
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
 def build_proxy_kwargs() -> dict:
     proxies = {}
     if os.getenv("HTTP_PROXY"):
@@ -37,16 +122,9 @@ def build_proxy_kwargs() -> dict:
     return {"proxies": proxies} if proxies else {}
 
 async def fetch_robots_txt(base: str) -> RobotExclusionRulesParser | None:
-    try:
-        async with httpx.AsyncClient(timeout=10, **build_proxy_kwargs()) as client:
-            r = await client.get(base.rstrip("/") + "/robots.txt", headers=randomized_headers())
-            if r.status_code == 200 and r.text:
-                rp = RobotExclusionRulesParser()
-                rp.parse(r.text)
-                return rp
-    except Exception:
-        return None
-    return None
+    # cached per origin, see robots.RobotsCache
+    from .robots import get_robots_cache
+    return await get_robots_cache().get(base)
 
 def allowed_by_robots(rp: RobotExclusionRulesParser | None, url: str) -> bool:
     if rp is None: